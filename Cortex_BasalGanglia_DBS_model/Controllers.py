@@ -97,7 +97,7 @@ class ZeroController:
         offset,
         last_pulse_time_prior=0,
     ):
-        return generate_monophasic_square_dbs_signal(
+        return pulse_train_generator.generate(
             start_time,
             stop_time,
             dt,
@@ -191,7 +191,7 @@ class ConstantController:
         offset,
         last_pulse_time_prior=0,
     ):
-        return generate_monophasic_square_dbs_signal(
+        return pulse_train_generator.generate(
             start_time,
             stop_time,
             dt,
@@ -631,7 +631,7 @@ class StandardPIDController:
         offset,
         last_pulse_time_prior=0,
     ):
-        return generate_monophasic_square_dbs_signal(
+        return pulse_train_generator.generate(
             start_time,
             stop_time,
             dt,
@@ -966,7 +966,7 @@ class IterativeFeedbackTuningPIController:
         offset,
         last_pulse_time_prior=0,
     ):
-        return generate_monophasic_square_dbs_signal(
+        return pulse_train_generator.generate(
             start_time,
             stop_time,
             dt,
@@ -1112,3 +1112,207 @@ def generate_monophasic_square_dbs_signal(
         dbs_signal *= amplitude
 
     return dbs_signal, times, next_pulse_time, last_pulse_time
+
+
+class PulseTrainGenerator:
+    """Monophasic square DBS pulse train generator
+
+    Generates exactly the same signal and pulse times as
+    generate_monophasic_square_dbs_signal. The phase of the pulse train is
+    anchored at start_time, so sample k of every segment only depends on k,
+    the frequency, the pulse width and dt. The pulse pattern (1 during a
+    pulse, 0 otherwise) is evaluated once with scipy.signal.square, in the
+    same way as the original function, and cached per (frequency,
+    pulse_width, dt) with the indices of its falling edges. A segment is a
+    slice of the cached pattern, and the last pulse is found by a binary
+    search of the falling edges instead of searching the signal.
+
+    As in the original function, the final sample is forced to zero, which
+    counts as the falling edge of the last pulse when the sample before it
+    is positive, e.g. for any positive DC offset.
+
+    At most max_templates patterns are kept, the least recently added are
+    dropped first (e.g. with frequency modulation, where the frequency
+    changes at every controller call).
+
+    Segments longer than max_template_length, with fewer than two samples,
+    or with a pulse longer than the inter-pulse interval are generated by
+    generate_monophasic_square_dbs_signal. With compat=True, generate()
+    always calls generate_monophasic_square_dbs_signal.
+
+    Inputs:
+        compat                  - use generate_monophasic_square_dbs_signal
+
+        max_template_length     - longest pulse pattern cached (samples)
+
+        max_templates           - largest number of pulse patterns cached
+    """
+
+    def __init__(self, compat=False, max_template_length=2**20, max_templates=32):
+        self.compat = compat
+        self.max_template_length = max_template_length
+        self.max_templates = max_templates
+        self._templates = {}
+
+    def _template(self, frequency, pulse_width, dt, n_samples):
+        """Cached pulse pattern of at least n_samples and the indices of
+        its falling edges"""
+        key = (frequency, pulse_width, dt)
+        template = self._templates.get(key)
+        if template is None or len(template[0]) < n_samples:
+            length = n_samples
+            if template is not None:
+                length = max(length, min(2 * len(template[0]), self.max_template_length))
+            # Same arithmetic as generate_monophasic_square_dbs_signal
+            tmp = np.arange(length) * dt / 1000.0
+            isi = 1000.0 / frequency  # time is in ms
+            duty_cycle = pulse_width / isi
+            tt = 2.0 * np.pi * frequency * tmp
+            pattern = 0.5 * (1.0 + signal.square(tt, duty=duty_cycle))
+            falling_edges = np.flatnonzero(pattern[1:] < pattern[:-1])
+            template = (pattern, falling_edges)
+            self._templates.pop(key, None)
+            while len(self._templates) >= self.max_templates:
+                del self._templates[next(iter(self._templates))]
+            self._templates[key] = template
+        return template
+
+    def generate(
+        self,
+        start_time,
+        stop_time,
+        dt,
+        amplitude,
+        frequency,
+        pulse_width,
+        offset,
+        last_pulse_time_prior=0,
+    ):
+        """Generate a DBS signal segment, with the same parameters and
+        return values as generate_monophasic_square_dbs_signal"""
+        times = np.round(np.arange(start_time, stop_time, dt), 2)
+        n_samples = len(np.arange(0, stop_time - start_time, dt))
+
+        if (
+            self.compat
+            or frequency < 0
+            or n_samples < 2
+            or n_samples > self.max_template_length
+            or not 0 <= pulse_width * frequency <= 1000.0
+        ):
+            return generate_monophasic_square_dbs_signal(
+                start_time,
+                stop_time,
+                dt,
+                amplitude,
+                frequency,
+                pulse_width,
+                offset,
+                last_pulse_time_prior=last_pulse_time_prior,
+            )
+
+        if frequency == 0:
+            return np.zeros(n_samples), times, 1e9, last_pulse_time_prior
+
+        isi = 1000.0 / frequency  # time is in ms
+        pattern, falling_edges = self._template(frequency, pulse_width, dt, n_samples)
+        dbs_signal = offset + pattern[:n_samples]
+        dbs_signal[-1] = 0.0
+
+        # Last falling edge of the signal: the forced zero final sample if
+        # the sample before it is positive, otherwise the last falling edge
+        # of the pattern before it
+        if dbs_signal[-2] > 0:
+            last_pulse_index = n_samples - 2
+        else:
+            n_edges = np.searchsorted(falling_edges, n_samples - 2)
+            last_pulse_index = falling_edges[n_edges - 1] if n_edges > 0 else None
+
+        if last_pulse_index is not None:
+            next_pulse_time = times[last_pulse_index] + isi - pulse_width
+
+            # Track when the last pulse was
+            last_pulse_time = times[last_pulse_index]
+        else:
+            # Signal is flat
+            last_pulse_index = n_samples - 1
+            next_pulse_time = times[last_pulse_index] + isi - pulse_width
+            last_pulse_time = last_pulse_time_prior
+
+        # Rescale amplitude
+        dbs_signal *= amplitude
+
+        return dbs_signal, times, next_pulse_time, last_pulse_time
+
+
+def check_pulse_train_generator(generator=None, n_segments=500, dt=0.01, seed=0):
+    """Compare PulseTrainGenerator.generate with
+    generate_monophasic_square_dbs_signal over a sweep of segments
+
+    The segments cover the default 130 Hz and random frequencies from 20 to
+    200 Hz (and some with no stimulation), common and random pulse widths,
+    start times from 6000 to 20000 ms, segment lengths from under a sample
+    to 50 ms, and zero, positive and negative DC offsets.
+
+    Inputs:
+        generator   - PulseTrainGenerator to check, a new one if None
+
+        n_segments  - number of segments compared
+
+        dt          - timestep (ms)
+
+        seed        - random seed of the sweep
+
+    Returns a list of the (start_time, stop_time, dt, amplitude, frequency,
+    pulse_width, offset, last_pulse_time_prior) of the segments that differ
+    """
+    if generator is None:
+        generator = PulseTrainGenerator()
+    rng = np.random.default_rng(seed)
+    mismatches = []
+    for ii in range(n_segments):
+        if ii % 50 == 0:
+            frequency = 0.0
+        elif ii % 2:
+            frequency = 130.0
+        else:
+            frequency = rng.uniform(20, 200)
+        pulse_width = rng.choice([0.06, 0.09, 0.12, rng.uniform(0.01, 0.5)])
+        start_time = round(rng.uniform(6000, 20000), 2)
+        stop_time = start_time + rng.choice([20.0, rng.uniform(0, 2), rng.uniform(2, 50)])
+        offset = rng.choice([0.0, 0.0, 0.5, -0.5, rng.uniform(-2, 2)])
+        parameters = (
+            start_time,
+            stop_time,
+            dt,
+            -1.5,
+            frequency,
+            pulse_width,
+            offset,
+            rng.uniform(0, start_time),
+        )
+        try:
+            expected = generate_monophasic_square_dbs_signal(*parameters)
+        except IndexError:
+            # Segment with no samples
+            continue
+        result = generator.generate(*parameters)
+        if not (
+            np.array_equal(expected[0], result[0])
+            and np.array_equal(expected[1], result[1])
+            and expected[2] == result[2]
+            and expected[3] == result[3]
+        ):
+            mismatches.append(parameters)
+    return mismatches
+
+
+# Pulse train generator used by the controllers, configured by run_model
+pulse_train_generator = PulseTrainGenerator()
+
+
+if __name__ == "__main__":
+    mismatches = check_pulse_train_generator()
+    for parameters in mismatches:
+        print("Pulse train differs for", parameters)
+    print(f"{len(mismatches)} mismatching DBS signal segments")
@@ -7,6 +7,11 @@ Description: Functions for calculating cell distances to electrode. Distance is
              a cell position and a point for an electrode rather than between
              two cell positions
 
+             The distances are worked out for a whole population at once from
+             its (3 x n) positions array, for any number of electrodes, and
+             cached by the positions and electrode geometry, see
+             electrode_distances() and segment_electrode_distances().
+
 Edits:
     10-01-18: Created electrode_distance function
 
@@ -18,11 +23,113 @@ Edits:
 # Distance computations are provided by scipy.spatial, but scipy is a fairly
 # heavy dependency.
 
+import hashlib
 import numpy as np
 import logging
 
 logger = logging.getLogger("PyNN")
 
+# Distance arrays by (kind, positions hash, electrode geometry)
+_distance_cache = {}
+
+
+def _array_key(array):
+    array = np.ascontiguousarray(array, dtype=float)
+    return (array.shape, hashlib.sha1(array.tobytes()).hexdigest())
+
+
+def _cached(key, compute):
+    if key not in _distance_cache:
+        distances = compute()
+        distances.setflags(write=False)
+        _distance_cache[key] = distances
+    return _distance_cache[key]
+
+
+def clear_distance_cache():
+    _distance_cache.clear()
+
+
+def electrode_distances(electrode_positions, positions, coordinate_mask=None):
+    """
+    Return the (m x n) array of the Euclidian distances from m point source
+    electrodes to n cells.
+    'electrode_positions' is an (m x 3) array of electrode positions in xyz
+    co-ordinates, or a single position.
+    'positions' is the (3 x n) array of cell positions, as
+    Population.positions.
+    `coordinate_mask` allows only certain dimensions to be considered, as in
+    distance_to_electrode.
+    The result is cached and read-only.
+    """
+    electrode_positions = np.atleast_2d(np.asarray(electrode_positions, dtype=float))
+    positions = np.asarray(positions, dtype=float)
+    if coordinate_mask is None:
+        dimensions = np.arange(3)
+    else:
+        dimensions = np.atleast_1d(coordinate_mask)
+    key = (
+        "cell",
+        _array_key(positions),
+        _array_key(electrode_positions),
+        tuple(int(dimension) for dimension in dimensions),
+    )
+
+    def compute():
+        d = electrode_positions[:, dimensions, None] - positions[None, dimensions, :]
+        return np.sqrt(np.einsum("mkn,mkn->mn", d, d))
+
+    return _cached(key, compute)
+
+
+def collateral_segment_z(L, nseg):
+    """
+    Return the z co-ordinates of the centres of the nseg segments of a
+    collateral of length L, centred on z = 0.
+    """
+    segment_centres = np.arange(0, nseg + 3 - 1) * (1 / nseg)
+    segment_centres = segment_centres - (1 / (2 * nseg))
+    segment_centres[0] = 0
+    segment_centres[-1] = 1
+    segment_centres = segment_centres[1 : len(segment_centres) - 1]
+
+    return L * segment_centres - L / 2
+
+
+def segment_electrode_distances(electrode_positions, positions, segment_z):
+    """
+    Return the (m x n x nseg) array of the Euclidian distances from m point
+    source electrodes to the nseg segments of n cells. Each segment is at
+    the x and y co-ordinates of its cell and at z co-ordinate segment_z.
+    'electrode_positions' is an (m x 3) array of electrode positions in xyz
+    co-ordinates, or a single position.
+    'positions' is the (3 x n) array of cell positions, as
+    Population.positions.
+    The result is cached and read-only.
+    """
+    electrode_positions = np.atleast_2d(np.asarray(electrode_positions, dtype=float))
+    positions = np.asarray(positions, dtype=float)
+    segment_z = np.asarray(segment_z, dtype=float)
+    key = (
+        "segment",
+        _array_key(positions[:2]),
+        _array_key(electrode_positions),
+        _array_key(segment_z),
+    )
+
+    def compute():
+        dx = electrode_positions[:, 0, None] - positions[0]
+        dy = electrode_positions[:, 1, None] - positions[1]
+        dz = electrode_positions[:, 2, None] - segment_z
+        d_squared = (dx**2 + dy**2)[:, :, None] + (dz**2)[:, None, :]
+        return np.sqrt(d_squared)
+
+    return _cached(key, compute)
+
+
+def _local_positions(tgt_pop):
+    return tgt_pop.positions[:, tgt_pop._mask_local]
+
 
 def distance_to_electrode(src_electrode, tgt_cell, mask=None):
     """
@@ -53,15 +160,10 @@ def distances_to_electrode(src_electrode, tgt_pop, coordinate_mask=None):
     'tgt_pop' is the target population of cells.
     """
 
-    cell_electrode_distances = np.zeros((tgt_pop.local_size, 1))
-    cell_electrode_distances.flatten()
-
-    for ii, tgt_cell in enumerate(tgt_pop):
-        cell_electrode_distances[ii] = distance_to_electrode(
-            src_electrode, tgt_cell, mask=coordinate_mask
-        )
-
-    return cell_electrode_distances
+    distances = electrode_distances(
+        src_electrode, _local_positions(tgt_pop), coordinate_mask
+    )
+    return distances.reshape(-1, 1).copy()
 
 
 def collateral_distances_to_electrode(src_electrode, tgt_pop, L, nseg):
@@ -80,24 +182,7 @@ def collateral_distances_to_electrode(src_electrode, tgt_pop, L, nseg):
     a collateral of a single cortical cell. Each column corresponds to a
     segment of the collateral.
     """
-    segment_electrode_distances = np.zeros((tgt_pop.local_size, nseg))
-
-    segment_centres = np.arange(0, nseg + 3 - 1) * (1 / nseg)
-    segment_centres = segment_centres - (1 / (2 * nseg))
-    segment_centres[0] = 0
-    segment_centres[-1] = 1
-    segment_centres = segment_centres[1 : len(segment_centres) - 1]
-
-    z_coordinate = L * segment_centres - L / 2
-    # print(z_coordinate)
-
-    for ii, tgt_cell in enumerate(tgt_pop):
-        for seg in np.arange(nseg):
-            tgt_cell.position = np.array(
-                [tgt_cell.position[0], tgt_cell.position[1], z_coordinate[seg]]
-            )
-            segment_electrode_distances[ii][seg] = distance_to_electrode(
-                src_electrode, tgt_cell
-            )
-
-    return segment_electrode_distances
+    distances = segment_electrode_distances(
+        src_electrode, _local_positions(tgt_pop), collateral_segment_z(L, nseg)
+    )
+    return distances[0].copy()
@@ -29,6 +29,7 @@ from pyNN import common
 import logging
 import numpy
 import os.path
+import time
 from neuron import h, nrn_dll_loaded
 from operator import itemgetter
 
@@ -225,6 +226,9 @@ class _State(common.control.BaseState):
         self.gid_sources = []
         self.recorders = set([])
         self.current_sources = []
+        self._step_current_sources = []     # sources that need a breakpoint at each tstop
+        self._changed_current_sources = {}  # sources with IClamps to set up, by id
+        self.current_source_updates = []    # (tstop, sources, IClamps, seconds) of each update
         self.gid_counter = 0
         self.vargid_offsets = dict()  # Contains the start of the available "variable"-GID range for each projection (as opposed to "cell"-GIDs)
         h.plastic_connections = []
@@ -258,10 +262,39 @@ class _State(common.control.BaseState):
                     assert local_minimum_delay >= self.min_delay, \
                        "There are connections with delays (%g) shorter than the minimum delay (%g)" % (local_minimum_delay, self.min_delay)
 
+    def register_current_source(self, source):
+        self.current_sources.append(source)
+        if source._is_playable and not source._is_computed:
+            self._step_current_sources.append(source)
+
+    def current_source_changed(self, source):
+        """Mark a current source whose IClamps must be set up before the next
+        run."""
+        self._changed_current_sources[id(source)] = source
+
     def _update_current_sources(self, tstop):
-        for source in self.current_sources:
-            for iclamp in source._devices:
-                source._update_iclamp(iclamp, tstop)
+        # Only the sources with new IClamps, and the step sources that do not
+        # have a breakpoint at tstop yet, are updated. IClamps that are
+        # already bound to their vectors are left alone.
+        start = time.perf_counter()
+        changed = self._changed_current_sources
+        self._changed_current_sources = {}
+        for source in self._step_current_sources:
+            if source._insert_breakpoint(tstop):
+                changed[id(source)] = source
+        n_iclamps = sum(source._bind_iclamps() for source in changed.values())
+        self.current_source_updates.append(
+            (tstop, len(changed), n_iclamps, time.perf_counter() - start))
+
+    def current_source_report(self):
+        """Summary of the current source updates made before each run."""
+        if not self.current_source_updates:
+            return "No current source updates"
+        updates = numpy.array([update[1:] for update in self.current_source_updates])
+        return ("%d current source updates: %d sources and %d IClamps updated "
+                "in %.3f s (%.3g s max per update)"
+                % (len(updates), updates[:, 0].sum(), updates[:, 1].sum(),
+                   updates[:, 2].sum(), updates[:, 2].max()))
 
     def run(self, simtime, run_from_steady_state=False):
         """Advance the simulation for a certain time."""
@@ -28,13 +28,14 @@ class NeuronCurrentSource(StandardCurrentSource):
         self._amplitudes = None
         self._times = None
         self._h_iclamps = {}
+        self._n_bound = 0    # the first _n_bound devices are up to date
         parameter_space = ParameterSpace(self.default_parameters,
                                          self.get_schema(),
                                          shape=(1,))
         parameter_space.update(**parameters)
         parameter_space = self.translate(parameter_space)
         self.set_native_parameters(parameter_space)
-        simulator.state.current_sources.append(self)
+        simulator.state.register_current_source(self)
 
     @property
     def _h_amplitudes(self):
@@ -59,10 +60,43 @@ class NeuronCurrentSource(StandardCurrentSource):
             self._amplitudes = None
             self._times = None
             self._generate()
-        for iclamp in self._h_iclamps.values():
-            self._update_iclamp(iclamp, 0.0)    # send tstop = 0.0 on _reset()
-
-    def _update_iclamp(self, iclamp, tstop):
+        self._n_bound = 0
+        self._insert_breakpoint(0.0)    # send tstop = 0.0 on _reset()
+        self._bind_iclamps()
+
+    def _insert_breakpoint(self, tstop):
+        """Add tstop to the time sequence of a StepCurrentSource, to handle
+        repeated runs, unless it is already there. Returns True if the
+        sequence was changed, in which case the IClamps must be bound to the
+        vectors again."""
+        # only StepCurrentSource (_is_playable = True, _is_computed = False)
+        if not self._is_playable or self._is_computed:
+            return False
+        # The step times are sorted, so look tstop up in a view of the vector
+        # rather than converting it to a list
+        times = self._h_times.as_numpy()
+        ind = int(numpy.searchsorted(times, tstop))
+        if ind < len(times) and times[ind] == tstop:
+            return False
+        if ind == 0:    # tstop before first specified time instant
+            amp_val = 0.0
+        else:
+            amp_val = self._h_amplitudes.x[ind - 1]
+        self._h_times.insrt(ind, tstop)
+        self._h_amplitudes.insrt(ind, amp_val)
+        self._n_bound = 0
+        return True
+
+    def _bind_iclamps(self):
+        """Set up the IClamps that are not up to date and return how many
+        there were"""
+        n_unbound = len(self._devices) - self._n_bound
+        for iclamp in self._devices[self._n_bound:]:
+            self._bind_iclamp(iclamp)
+        self._n_bound = len(self._devices)
+        return n_unbound
+
+    def _bind_iclamp(self, iclamp):
         if not self._is_playable:
             iclamp.delay = self.start
             iclamp.dur = self.stop - self.start
@@ -72,20 +106,6 @@ class NeuronCurrentSource(StandardCurrentSource):
             iclamp.delay = 0.0
             iclamp.dur = 1e12
             iclamp.amp = 0.0
-
-            # check exists only for StepCurrentSource (_is_playable = True, _is_computed = False)
-            # t_stop should be part of the time sequence to handle repeated runs
-            if not self._is_computed and tstop not in self._h_times.to_python():
-                ind = self._h_times.indwhere(">=", tstop)
-                if ind == -1:   # tstop beyond last specified time instant
-                    ind = self._h_times.size()
-                if ind == 0.0:    # tstop before first specified time instant
-                    amp_val = 0.0
-                else:
-                    amp_val = self._h_amplitudes.x[int(ind)-1]
-                self._h_times.insrt(ind, tstop)
-                self._h_amplitudes.insrt(ind, amp_val)
-
             self._h_amplitudes.play(iclamp._ref_amp, self._h_times)
 
     def _check_step_times(self, times, amplitudes, resolution):
@@ -141,6 +161,8 @@ class NeuronCurrentSource(StandardCurrentSource):
                     else:
                         self._h_iclamps[id] = h.IClamp(0.5, sec=id._cell.source_section)
                     self._devices.append(self._h_iclamps[id])
+        if self._n_bound < len(self._devices):
+            simulator.state.current_source_changed(self)
 
     def record(self):
         self.itrace = h.Vector()
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Beta-band biomarker estimation for the closed-loop controllers.
+
+             The biomarker is the beta Average Rectified Value (ARV) of the
+             STN LFP. The reference implementation (calculate_avg_beta_power)
+             runs filtfilt over the whole controller window at every call and
+             only keeps a short slice near its end. BetaBiomarker can compute
+             the same quantity while filtering far fewer samples.
+"""
+
+import numpy as np
+import scipy.signal as signal
+from utils import make_beta_cheby1_filter, calculate_avg_beta_power, RingBuffer
+
+
+def filter_settling_length(sos, n_max, tol=1e-2):
+    """Number of samples after which the impulse response of a filter has
+    decayed below `tol` of its peak (at most n_max)"""
+    impulse = np.zeros(n_max)
+    impulse[0] = 1.0
+    response = np.abs(signal.sosfilt(sos, impulse))
+    above = np.nonzero(response > tol * response.max())[0]
+    return int(above[-1]) + 1
+
+
+class BetaBiomarker:
+    """Beta ARV estimator with three modes of operation:
+
+        "filtfilt"  - zero-phase filtering of the whole controller window
+                      (calculate_avg_beta_power, the original behaviour)
+
+        "lookback"  - zero-phase filtering of only the end of the window that
+                      influences the samples used for the ARV: twice the tail
+                      plus the time the filter needs to settle
+
+        "streaming" - causal second-order-section filter whose state is
+                      carried between calls, so each call only filters the
+                      new samples; the ARV is the mean rectified output over
+                      the last `tail_length` samples
+
+    With verify=True, the original filtfilt ARV is also computed at every call
+    and the estimate/reference pairs are stored in `verification_history`.
+
+    Inputs:
+        fs                  - sampling frequency of the LFP (Hz)
+
+        window_length       - length of the controller window (samples)
+
+        tail_length         - tail discarded due to the filtering artifact
+                              (samples)
+
+        mode                - "filtfilt", "lookback" or "streaming"
+
+        lookback_length     - number of samples filtered in "lookback" mode,
+                              calculated from the filter when None
+
+        verify              - also compute the reference filtfilt ARV
+    """
+
+    modes = ("filtfilt", "lookback", "streaming")
+
+    def __init__(
+        self,
+        fs,
+        window_length,
+        tail_length,
+        mode="filtfilt",
+        lookback_length=None,
+        verify=False,
+        n=4,
+        rp=0.5,
+        low=21,
+        high=29,
+    ):
+        if mode not in self.modes:
+            raise ValueError(f"Unknown biomarker mode: {mode}")
+        self.mode = mode
+        self.window_length = int(window_length)
+        self.tail_length = int(tail_length)
+        self.verify = verify
+
+        self.beta_b, self.beta_a = make_beta_cheby1_filter(fs, n, rp, low, high)
+        self.sos = make_beta_cheby1_filter(fs, n, rp, low, high, output="sos")
+
+        if lookback_length is None:
+            lookback_length = 2 * self.tail_length + filter_settling_length(
+                self.sos, self.window_length
+            )
+        self.lookback_length = min(int(lookback_length), self.window_length)
+
+        self._zi = None
+        self._rectified = RingBuffer(self.tail_length)
+        self.verification_history = []
+
+    def update(self, new_samples, window):
+        """Calculate the biomarker after new LFP samples were recorded
+
+        Inputs:
+            new_samples     - LFP samples recorded since the last call
+
+            window          - last `window_length` samples of the LFP,
+                              including new_samples
+        """
+        if self.mode == "streaming":
+            value = self._update_streaming(new_samples)
+        elif self.mode == "lookback":
+            lfp_beta_signal = signal.filtfilt(
+                self.beta_b, self.beta_a, window[-self.lookback_length :]
+            )
+            lfp_beta_signal_rectified = np.absolute(lfp_beta_signal)
+            value = np.mean(
+                lfp_beta_signal_rectified[-2 * self.tail_length : -self.tail_length]
+            )
+        else:
+            value = calculate_avg_beta_power(
+                window, self.tail_length, self.beta_b, self.beta_a
+            )
+
+        if self.verify:
+            if self.mode == "filtfilt":
+                reference = value
+            else:
+                reference = calculate_avg_beta_power(
+                    window, self.tail_length, self.beta_b, self.beta_a
+                )
+            self.verification_history.append((value, reference))
+
+        return value
+
+    def _update_streaming(self, new_samples):
+        new_samples = np.asarray(new_samples, dtype=np.float64)
+        if len(new_samples) > 0:
+            if self._zi is None:
+                self._zi = signal.sosfilt_zi(self.sos) * new_samples[0]
+            lfp_beta_signal, self._zi = signal.sosfilt(
+                self.sos, new_samples, zi=self._zi
+            )
+            self._rectified.append(np.absolute(lfp_beta_signal))
+        if len(self._rectified) == 0:
+            return 0.0
+        return np.mean(self._rectified.view())
+
+    def verification_summary(self):
+        """Maximum absolute and relative deviation of the estimates from the
+        filtfilt reference"""
+        if not self.verification_history:
+            return {"calls": 0, "max_abs_deviation": 0.0, "max_rel_deviation": 0.0}
+        estimate, reference = np.asarray(self.verification_history).T
+        deviation = np.abs(estimate - reference)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            relative = np.where(reference != 0, deviation / np.abs(reference), 0.0)
+        return {
+            "calls": len(deviation),
+            "max_abs_deviation": float(deviation.max()),
+            "max_rel_deviation": float(relative.max()),
+        }
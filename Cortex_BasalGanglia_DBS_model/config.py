@@ -79,10 +79,37 @@ class Config(object):
         save_stn_voltage={"type": "boolean", "coerce": bool, "default": True},
         save_ctx_voltage={"type": "boolean", "coerce": bool, "default": False},
         save_ctx_lfp={"type": "boolean", "coerce": bool, "default": False},
+        save_stn_lfp_components={"type": "boolean", "coerce": bool, "default": False},
+        stn_voltage_flush_calls={"type": "integer", "coerce": int, "default": 10},
+        stn_voltage_flush_mb={"type": "float", "coerce": float, "default": 64.0},
+        async_io={"type": "boolean", "coerce": bool, "default": True},
+        async_io_queue_size={"type": "integer", "coerce": int, "default": 4},
+        recording_memory_budget_mb={"type": "float", "coerce": float, "default": 0},
         create_new_network={"type": "boolean", "coerce": bool, "default": False},
+        network_bundle={"type": "string", "coerce": str, "default": ""},
+        network_bundle_verify={"type": "boolean", "coerce": bool, "default": False},
+        array_connectors={"type": "boolean", "coerce": bool, "default": True},
+        procedural_connectivity={"type": "boolean", "coerce": bool, "default": False},
+        membrane_noise={
+            "type": "string",
+            "coerce": (str, lambda x: x.lower()),
+            "default": "point_process",
+            "allowed": ("point_process", "current_source"),
+            },
         Pop_size={"type": "integer", "coerce": int, "default": 100},
         controller_window_length={"type": "float", "coerce": float, "default": 2000.0},
         controller_window_tail_length={"type": "float", "coerce": float, "default": 100.0},
+        biomarker_mode={
+            "type": "string",
+            "coerce": (str, lambda x: x.lower()),
+            "default": "filtfilt",
+            "allowed": ("filtfilt", "lookback", "streaming"),
+            },
+        biomarker_lookback_length={"type": "float", "coerce": float, "default": 0},
+        biomarker_verify={"type": "boolean", "coerce": bool, "default": False},
+        controller_rank0_only={"type": "boolean", "coerce": bool, "default": False},
+        dbs_buffer_horizon={"type": "float", "coerce": float, "default": 0},
+        dbs_pulse_compat={"type": "boolean", "coerce": bool, "default": False},
         fix_kp={"type": "boolean", "coerce": bool, "default": False},
         fix_ti={"type": "boolean", "coerce": bool, "default": False},
         stimulation_amplitude={"type": "float", "coerce": float, "default": 0},
@@ -96,6 +123,7 @@ class Config(object):
         ctx_slow_modulation_amplitude={"type": "float", "coerce": float, "default": 0},
         ctx_slow_modulation_step_count={"type": "integer", "coerce": int, "default": 0},
         beta_burst_modulation_scale={"type": "float", "coerce": float, "default": 0.02},
+        burst_scenario={"type": "integer", "coerce": int, "default": 1, "min": 1, "max": 10},
         # If cortical beta is spike modulated
         ctx_beta_spike_frequency={"type": "float", "coerce": float, "default": 26},
         ctx_beta_synapse_strength={"type": "float", "coerce": float, "default": 0.005},
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Fast construction of the projections of the network.
+
+             ArrayConnector builds a projection from arrays of presynaptic
+             index, postsynaptic index, weight and delay. The connections
+             onto cells owned by other ranks are dropped with a NumPy mask
+             before any NetCon is made, and the remaining connections are
+             grouped by postsynaptic cell with a single sort, so each rank
+             only does the work for its own cells.
+
+             The time taken to build each projection is kept in
+             `build_report`, see gather_build_report().
+
+             New networks can be generated procedurally: the presynaptic
+             cells and weights of the connections onto each cell are drawn
+             from a counter-based random number generator keyed by (seed,
+             projection, postsynaptic cell), so each rank generates the
+             connections onto its own cells without any file I/O, and the
+             network does not depend on the number of ranks.
+"""
+
+import time
+
+import numpy as np
+from pyNN.connectors import Connector
+from utils import counter_uniform, stream_id
+
+# (projection label, local connections, build time in s) of every projection
+# built with an ArrayConnector on this rank
+build_report = []
+
+
+class ArrayConnector(Connector):
+    """Connects the cells given by an (n x 4) array of (pre, post, weight,
+    delay) rows, in the same layout as the connection text files. The weight
+    and delay of each connection are taken from the array.
+
+    Inputs:
+        connections     - (n x 4) array of connections, only the rows onto
+                          local postsynaptic cells are used
+
+        safe            - passed to pyNN Connector
+
+        callback        - passed to pyNN Connector
+    """
+
+    parameter_names = ("weight", "delay")
+
+    def __init__(self, connections, safe=True, callback=None):
+        Connector.__init__(self, safe=safe, callback=callback)
+        self.connections = np.asarray(connections, dtype=np.float64).reshape(-1, 4)
+
+    def connect(self, projection):
+        start = time.perf_counter()
+        post = self.connections[:, 1].astype(np.int64)
+        local = projection.post._mask_local[post]
+        connections = self.connections[local]
+        post = post[local]
+
+        order = np.argsort(post, kind="stable")
+        connections = connections[order]
+        post = post[order]
+        targets, first = np.unique(post, return_index=True)
+        last = np.append(first[1:], len(post))
+
+        pre = connections[:, 0].astype(np.int64)
+        for target, l, r in zip(targets, first, last):
+            projection._convergent_connect(
+                pre[l:r],
+                int(target),
+                weight=connections[l:r, 2],
+                delay=connections[l:r, 3],
+            )
+
+        build_report.append(
+            (projection.label, len(connections), time.perf_counter() - start)
+        )
+
+
+def gather_build_report(comm):
+    """Gather the projection build times of all ranks on rank 0 and return
+    a table of the connections and the slowest and mean build time of each
+    projection (None on the other ranks)"""
+    reports = comm.gather(build_report, root=0)
+    if comm.Get_rank() != 0:
+        return None
+    lines = ["------ Projection build times ------"]
+    for ii, (label, _, _) in enumerate(reports[0]):
+        n_connections = sum(report[ii][1] for report in reports)
+        times = np.array([report[ii][2] for report in reports])
+        lines.append(
+            f"{label:<50} {n_connections:>9} connections "
+            f"{times.max():8.3f} s max {times.mean():8.3f} s mean"
+        )
+    total = np.array([sum(entry[2] for entry in report) for report in reports])
+    lines.append(f"Total build time: {total.max():.3f} s max, {total.mean():.3f} s mean")
+    return "\n".join(lines)
+
+
+# Connections of each projection of the network, as in create_network:
+# projection name (see network_bundle.PROJECTION_FILES), number of
+# presynaptic cells per postsynaptic cell, weight (a value, or ("uniform",
+# low, high)), delay (ms) and whether the projection connects a population
+# to itself
+PROJECTION_SPECS = {
+    "CorticalAxonInterneuron": dict(n=10, weight=("uniform", 0, 2.5e-3), delay=2),
+    "InterneuronCortical": dict(n=10, weight=("uniform", 0, 6.0e-3), delay=2),
+    "CorticalSTN": dict(n=5, weight=0.12, delay=1),
+    "STNGPe": dict(n=1, weight=0.111111, delay=4),
+    "GPeGPe": dict(n=1, weight=0.015, delay=4, recurrent=True),
+    "GPeSTN": dict(n=2, weight=0.111111, delay=3),
+    "StriatalGPe": dict(n=1, weight=0.01, delay=1),
+    "STNGPi": dict(n=1, weight=0.111111, delay=2),
+    "GPeGPi": dict(n=1, weight=0.111111, delay=2),
+    "GPiThalamic": dict(n=1, weight=3.0, delay=2),
+    "ThalamicCorticalSoma": dict(n=1, weight=5, delay=2),
+    "CorticalSomaThalamic": dict(n=1, weight=0.0, delay=2),
+}
+
+
+def fixed_number_pre(seed, stream, post_indices, n_pre_cells, n, allow_self=True):
+    """Draw `n` distinct presynaptic cells out of `n_pre_cells` for each
+    postsynaptic cell, like pyNN FixedNumberPreConnector without replacement
+
+    Returns a (len(post_indices) x n) array of presynaptic cell indices
+    """
+    post_indices = np.asarray(post_indices, dtype=np.int64)
+    n_available = n_pre_cells - (0 if allow_self else 1)
+    if n > n_available:
+        raise ValueError(f"Can not draw {n} presynaptic cells out of {n_available}")
+    pre = np.full((len(post_indices), n), -1, dtype=np.int64)
+    for column in range(n):
+        # Cells whose candidate was rejected draw again with the next counter
+        pending = np.arange(len(post_indices))
+        attempt = 0
+        while len(pending):
+            counter = attempt * n + column
+            u = counter_uniform(seed, stream, post_indices[pending], [counter])[:, 0]
+            candidates = np.minimum((u * n_pre_cells).astype(np.int64), n_pre_cells - 1)
+            rejected = np.any(pre[pending, :column] == candidates[:, None], axis=1)
+            if not allow_self:
+                rejected |= candidates == post_indices[pending]
+            pre[pending[~rejected], column] = candidates[~rejected]
+            pending = pending[rejected]
+            attempt += 1
+    return pre
+
+
+def generate_connections(name, seed, post_indices, n_pre_cells, spec=None):
+    """Generate the connections of a projection onto `post_indices`
+
+    Inputs:
+        name            - projection name, a key of PROJECTION_SPECS
+
+        seed            - random seed of the network
+
+        post_indices    - indices of the postsynaptic cells, e.g. the local
+                          cells
+
+        n_pre_cells     - size of the presynaptic population
+
+        spec            - projection spec, PROJECTION_SPECS[name] if None
+
+    Returns an (n x 4) array of (pre, post, weight, delay) rows
+    """
+    if spec is None:
+        spec = PROJECTION_SPECS[name]
+    stream = stream_id(name)
+    post_indices = np.asarray(post_indices, dtype=np.int64)
+    n = spec["n"]
+    pre = fixed_number_pre(
+        seed,
+        stream,
+        post_indices,
+        n_pre_cells,
+        n,
+        allow_self=not spec.get("recurrent", False),
+    )
+
+    connections = np.empty((pre.size, 4))
+    connections[:, 0] = pre.ravel()
+    connections[:, 1] = np.repeat(post_indices, n)
+    weight = spec["weight"]
+    if isinstance(weight, tuple):
+        _, low, high = weight
+        # Weights are drawn from their own stream of the projection
+        u = counter_uniform(seed, stream_id(name + ".weight"), post_indices, np.arange(n))
+        connections[:, 2] = (low + (high - low) * u).ravel()
+    else:
+        connections[:, 2] = weight
+    connections[:, 3] = spec["delay"]
+    return connections
+
+
+def scale_stimulation_order(order, pop_size, seed):
+    """Scale a stimulation order of cell indices to a population of pop_size
+    cells
+
+    Cell i of the new population takes the place in the order of cell
+    floor(i * len(order) / pop_size) of the original one, with the cells that
+    share a place ordered randomly, so any leading fraction of the new order
+    covers the same part of the population as in the original order.
+    """
+    order = np.asarray(order, dtype=np.int64)
+    if len(order) == pop_size:
+        return [int(index) for index in order]
+    place = np.empty(len(order))
+    place[order] = np.arange(len(order))
+    cells = np.arange(pop_size)
+    key = place[cells * len(order) // pop_size]
+    key += counter_uniform(seed, stream_id("GPe_stimulation_order"), cells, [0])[:, 0]
+    return [int(index) for index in np.argsort(key, kind="stable")]
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Current injections into whole populations that avoid creating
+             a pyNN current source, with its precomputed waveform vectors,
+             per cell.
+
+             inject_membrane_noise() gives every cell a MembraneNoise point
+             process (see neuron_mechanisms), which draws the noise samples
+             during the simulation from a Random123 stream keyed by the gid
+             of the cell and the seed.
+
+             PopulationCurrentSource injects a current with a different
+             amplitude, or time course, into every cell of a population. Its
+             IClamps are created together and it is registered with the
+             simulator as a single current source, so the cost of each run
+             does not grow with the number of cells.
+"""
+
+import numpy as np
+from neuron import h
+from pyNN.neuron import simulator
+from utils import stream_id
+
+
+def _soma(cell):
+    """Section to inject current into, the soma if the cell has more than
+    one source section (as in pyNN current sources)"""
+    if isinstance(cell._cell.source_section, dict):
+        return cell._cell.source_section["soma"]
+    return cell._cell.source_section
+
+
+def inject_membrane_noise(population, mean, stdev, start, stop, dt, seed):
+    """Inject Gaussian noise current into every local cell of a population
+
+    The noise is the same as a pyNN NoisyCurrentSource with the same
+    parameters, a new sample every dt ms from start to stop, but is drawn on
+    the fly, and depends only on the gid of the cell and the seed.
+
+    Inputs:
+        population  - PyNN population
+
+        mean        - mean of the noise current (nA)
+
+        stdev       - standard deviation of the noise current (nA)
+
+        start       - time the noise starts (ms)
+
+        stop        - time the noise stops (ms)
+
+        dt          - time between noise samples (ms)
+
+        seed        - random seed
+
+    Returns the MembraneNoise point processes, which are also kept by the
+    cells
+    """
+    stream = stream_id("membrane_noise") & 0x7FFFFFFF
+    noise_sources = []
+    for cell in population:
+        noise = h.MembraneNoise(0.5, sec=_soma(cell))
+        noise.mean = mean
+        noise.stdev = stdev
+        noise.interval = dt
+        setattr(noise, "del", start)
+        noise.dur = stop - start
+        noise.setstream(int(cell), seed, stream)
+        cell._cell.membrane_noise = noise
+        noise_sources.append(noise)
+    return noise_sources
+
+
+class PopulationCurrentSource:
+    """Current injected into every local cell of a population, with one
+    IClamp per cell.
+
+    Without times, each cell gets a constant current from start to stop, as
+    with a pyNN DCSource. With times, the current is a step-wise time course
+    as with a pyNN StepCurrentSource, given either by one sequence of
+    amplitudes shared by all cells or by one sequence per cell, on the same
+    time base.
+
+    Inputs:
+        population  - PyNN population
+
+        amplitudes  - current (nA); without times a value, or an array with
+                      the amplitude of each cell of the population; with
+                      times an array of the amplitude at each time, or a
+                      (population size x len(times)) array of the amplitudes
+                      of each cell
+
+        start       - time the constant current starts (ms)
+
+        stop        - time the constant current stops (ms)
+
+        times       - times of the amplitude steps (ms), shared by all cells
+    """
+
+    _is_computed = False
+
+    def __init__(self, population, amplitudes, start=0.0, stop=1e12, times=None):
+        indices = np.flatnonzero(population._mask_local)
+        cells = population.all_cells[indices]
+        self._devices = [h.IClamp(0.5, sec=_soma(cell)) for cell in cells]
+        self._n_bound = 0
+        self._is_playable = times is not None
+        amplitudes = np.asarray(amplitudes, dtype=float)
+
+        if self._is_playable:
+            self._h_times = h.Vector(np.asarray(times, dtype=float))
+            if amplitudes.ndim == 1:
+                # One vector played into every IClamp
+                self._h_amplitudes = [h.Vector(amplitudes)]
+                self._vector_index = np.zeros(len(cells), dtype=int)
+            else:
+                self._h_amplitudes = [h.Vector(amplitudes[index]) for index in indices]
+                self._vector_index = np.arange(len(cells))
+            for iclamp in self._devices:
+                iclamp.delay = 0.0
+                iclamp.dur = 1e12
+                iclamp.amp = 0.0
+            self._insert_breakpoint(0.0)
+        else:
+            amplitudes = np.broadcast_to(amplitudes, (population.size,))[indices]
+            for iclamp, amplitude in zip(self._devices, amplitudes):
+                iclamp.delay = start
+                iclamp.dur = stop - start
+                iclamp.amp = amplitude
+            self._n_bound = len(self._devices)
+
+        simulator.state.register_current_source(self)
+        self._bind_iclamps()
+
+    def _insert_breakpoint(self, tstop):
+        """Add tstop to the shared time base, as for a pyNN
+        StepCurrentSource, and return True if it was not there already"""
+        if not self._is_playable:
+            return False
+        times = self._h_times.as_numpy()
+        ind = int(np.searchsorted(times, tstop))
+        if ind < len(times) and times[ind] == tstop:
+            return False
+        for h_amplitudes in self._h_amplitudes:
+            amp_val = 0.0 if ind == 0 else h_amplitudes.x[ind - 1]
+            h_amplitudes.insrt(ind, amp_val)
+        self._h_times.insrt(ind, tstop)
+        self._n_bound = 0
+        return True
+
+    def _bind_iclamps(self):
+        """Play the amplitudes into the IClamps that are not bound yet and
+        return how many there were"""
+        n_unbound = len(self._devices) - self._n_bound
+        for ii in range(self._n_bound, len(self._devices)):
+            h_amplitudes = self._h_amplitudes[self._vector_index[ii]]
+            h_amplitudes.play(self._devices[ii]._ref_amp, self._h_times)
+        self._n_bound = len(self._devices)
+        return n_unbound
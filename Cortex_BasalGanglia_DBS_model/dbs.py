@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Time base of the DBS signals played into NEURON.
+
+             The DBS waveform is sampled on a uniform dt grid after a short
+             prefix of irregular samples (t = 0 and the end of the steady
+             state). Sample indices are calculated from the grid, so the
+             controller can splice a new DBS segment into the signal without
+             searching the full time vector, and only the next controller
+             interval of the signal is held in NEURON at a time.
+
+             The GPe neurons are stimulated with event-driven current pulses
+             (DBSPulse in neuron_mechanisms), so their stimulation needs no
+             sampled waveform.
+"""
+
+import numpy as np
+from neuron import h
+from utils import ChunkedArray
+
+
+class DBSTimeline:
+    """Uniform time grid of a DBS signal.
+
+    Times are mapped to sample indices by rounding to the nearest grid point.
+    A time further than `tolerance` (fraction of dt) from the grid is
+    rejected, as are times outside the signal. The grid times are rounded to
+    two decimals, as in generate_monophasic_square_dbs_signal.
+
+    Inputs:
+        prefix_times    - sample times before the uniform grid starts (ms)
+
+        start_time      - time of the first sample on the grid (ms)
+
+        stop_time       - end of the signal (ms), not included
+
+        dt              - sampling interval of the grid (ms)
+
+        tolerance       - largest accepted distance of a time from the grid,
+                          as a fraction of dt
+    """
+
+    def __init__(self, prefix_times, start_time, stop_time, dt, tolerance=0.25):
+        self.prefix_times = np.asarray(prefix_times, dtype=np.float64)
+        self.prefix_length = len(self.prefix_times)
+        self.start_time = float(start_time)
+        self.dt = float(dt)
+        self.tolerance = tolerance
+        # Same number of samples as np.arange(start_time, stop_time, dt)
+        grid_length = max(int(np.ceil((stop_time - start_time) / dt)), 0)
+        if grid_length == 0:
+            raise ValueError("DBS signal has no samples on the uniform grid")
+        self.size = self.prefix_length + grid_length
+
+    def __len__(self):
+        return self.size
+
+    def index(self, t):
+        """Return the sample index of time t (ms)"""
+        position = (t - self.start_time) / self.dt
+        grid_index = int(np.floor(position + 0.5))
+        if abs(position - grid_index) > self.tolerance:
+            raise ValueError(f"Time {t} ms is not on the DBS sample grid")
+        index = grid_index + self.prefix_length
+        if index < self.prefix_length or index >= self.size:
+            raise ValueError(f"Time {t} ms is outside the DBS signal")
+        return index
+
+    def floor_index(self, t):
+        """Return the index of the last sample at or before time t (ms)"""
+        if t < self.start_time - self.tolerance * self.dt:
+            return max(int(np.searchsorted(self.prefix_times, t, side="right")) - 1, 0)
+        position = (t - self.start_time) / self.dt
+        return int(np.floor(position + self.tolerance)) + self.prefix_length
+
+    def time(self, index):
+        """Return the time (ms) of a sample on the uniform grid"""
+        return self.start_time + (index - self.prefix_length) * self.dt
+
+    def times(self, start=0, stop=None):
+        """Return the sample times (ms) for indices start to stop, which may
+        extend past the end of the signal along the grid"""
+        if stop is None:
+            stop = self.size
+        indices = np.arange(start, stop)
+        on_grid = indices >= self.prefix_length
+        times = np.empty(len(indices))
+        times[~on_grid] = self.prefix_times[indices[~on_grid]]
+        times[on_grid] = np.round(
+            self.start_time
+            + (indices[on_grid] - self.prefix_length) * self.dt,
+            2,
+        )
+        return times
+
+    def segment_slice(self, start_time, n_samples):
+        """Return the slice of `n_samples` samples starting at start_time"""
+        start = self.index(start_time)
+        stop = start + int(n_samples)
+        if stop > self.size:
+            raise ValueError("DBS segment extends past the end of the signal")
+        return slice(start, stop)
+
+    def time_slice(self, start_time, stop_time):
+        """Return the slice of samples in the time range [start_time,
+        stop_time)"""
+        start = self.index(start_time)
+        if stop_time >= self.time(self.size):
+            return slice(start, self.size)
+        return slice(start, self.index(stop_time))
+
+    def assign(self, signal, start_time, segment):
+        """Overwrite the samples of `signal` from start_time onwards with
+        `segment`, and return the slice that was written"""
+        window = self.segment_slice(start_time, len(segment))
+        signal[window] = segment
+        return window
+
+
+class DBSPlayer:
+    """Plays a DBS signal into a NEURON variable one window at a time.
+
+    Only a window of `window_length` samples starting at the current time is
+    held in the NEURON vectors. At each controller call, advance() moves the
+    finished samples of the window to the signal history and starts a new,
+    zero window, into which the new DBS segment is written with assign().
+    The vectors keep the same size and are overwritten in place, so the
+    playback set up by NEURON at initialisation stays valid. Samples past the
+    end of the window hold the last value, which is zero.
+
+    Inputs:
+        timeline        - DBSTimeline of the signal
+
+        reference       - NEURON reference to play the signal into, e.g.
+                          h._ref_is_xtra
+
+        window_length   - number of samples played at a time, long enough to
+                          cover the time between controller calls
+    """
+
+    def __init__(self, timeline, reference, window_length):
+        self.timeline = timeline
+        self.window_length = int(window_length)
+        self.window_start = 0
+        self._times_neuron = h.Vector(timeline.times(0, self.window_length))
+        self._signal_neuron = h.Vector(self.window_length)
+        self._signal_neuron.play(reference, self._times_neuron, 1)
+        self._times = self._times_neuron.as_numpy()
+        self._signal = self._signal_neuron.as_numpy()
+        self._history = ChunkedArray()
+
+    def _store(self, stop):
+        """Move the samples before index `stop` to the history"""
+        n_done = min(stop, self.timeline.size) - self.window_start
+        n_played = min(max(n_done, 0), self.window_length)
+        self._history.append(self._signal[:n_played])
+        if n_done > n_played:
+            self._history.append(np.zeros(n_done - n_played))
+
+    def advance(self, t):
+        """Start a new window at the last sample at or before time t (ms)"""
+        start = self.timeline.floor_index(t)
+        if start < self.window_start:
+            raise ValueError(f"Can not move the DBS window back to {t} ms")
+        self._store(start)
+        self.window_start = start
+        self._times[:] = self.timeline.times(start, start + self.window_length)
+        self._signal[:] = 0
+
+    def assign(self, start_time, segment):
+        """Write a DBS segment starting at start_time (ms) into the window.
+        Samples before the window start have been played already and are
+        dropped."""
+        start = self.timeline.index(start_time) - self.window_start
+        segment = np.asarray(segment)
+        if start < 0:
+            segment = segment[-start:]
+            start = 0
+        stop = start + len(segment)
+        if stop > self.window_length:
+            raise ValueError("DBS segment extends past the end of the window")
+        self._signal[start:stop] = segment
+
+    def finish(self):
+        """Return the full DBS signal that was played"""
+        self._store(self.timeline.size)
+        self.window_start = self.timeline.size
+        return self._history.to_array()
+
+
+class GPeDBSStimulation:
+    """Event-driven DBS stimulation of the entrained GPe neurons.
+
+    Every local GPe neuron has a DBSPulse point process driven by a NetCon
+    without a source. The weight of the NetCon is the entrainment mask of the
+    neuron, and pulses are delivered by scheduling events at the pulse onset
+    times, so no per-neuron waveform is stored.
+
+    Inputs:
+        population      - PyNN population of GPe neurons
+
+        amplitude       - amplitude of the stimulation pulses (nA)
+
+        pulse_width     - width of the stimulation pulses (ms)
+    """
+
+    def __init__(self, population, amplitude=100.0, pulse_width=0.06):
+        self.population = population
+        self.pulses = []
+        self.netcons = []
+        for cell in population:
+            pulse = h.DBSPulse(0.5, sec=cell._cell.soma)
+            pulse.amp = amplitude
+            pulse.pulse_width = pulse_width
+            netcon = h.NetCon(None, pulse)
+            netcon.weight[0] = 0
+            self.pulses.append(pulse)
+            self.netcons.append(netcon)
+        self._entrained = np.zeros(len(self.netcons), dtype=bool)
+
+    def set_entrained(self, cell_indices):
+        """Set which neurons are stimulated, given their indices in the
+        population"""
+        entrained = np.zeros(len(self.netcons), dtype=bool)
+        for cell_index in cell_indices:
+            cell_id = self.population[int(cell_index)]
+            if self.population.is_local(cell_id):
+                entrained[self.population.id_to_local_index(cell_id)] = True
+
+        # Only the neurons whose state changed need to be updated
+        for index in np.nonzero(entrained != self._entrained)[0]:
+            self.netcons[index].weight[0] = float(entrained[index])
+        self._entrained = entrained
+
+    def deliver(self, onset_times):
+        """Schedule a pulse at each onset time (ms) in the entrained
+        neurons"""
+        for index in np.nonzero(self._entrained)[0]:
+            netcon = self.netcons[index]
+            for onset_time in onset_times:
+                netcon.event(onset_time)
+
+
+def pulse_onset_times(dbs_signal, times):
+    """Return the times at which the pulses of a DBS signal segment start"""
+    active = np.asarray(dbs_signal) != 0
+    onsets = active.copy()
+    onsets[1:] &= ~active[:-1]
+    return np.asarray(times)[onsets]
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Spatial layout of the neuron populations.
+
+             Positions of a whole population are drawn in batches: candidate
+             positions are sampled uniformly in the bounding box of a region,
+             and those outside the region or inside one of the exclusion
+             zones (e.g. the DBS lead) are rejected with NumPy masks, until
+             there are enough positions. Positions are (3 x n) arrays, as
+             Population.positions in pyNN.
+"""
+
+import numpy as np
+
+
+class Cuboid:
+    """Box of size width x height x depth (x, y, z) centred on origin (um)"""
+
+    def __init__(self, width, height, depth, origin=(0.0, 0.0, 0.0)):
+        self.half_size = 0.5 * np.array([width, height, depth], dtype=float)
+        self.origin = np.asarray(origin, dtype=float)
+
+    def bounds(self):
+        return self.origin - self.half_size, self.origin + self.half_size
+
+    def contains(self, positions):
+        offset = np.abs(positions - self.origin[:, None])
+        return np.all(offset <= self.half_size[:, None], axis=0)
+
+
+class Sphere:
+    """Sphere of the given radius centred on origin (um)"""
+
+    def __init__(self, radius, origin=(0.0, 0.0, 0.0)):
+        self.radius = float(radius)
+        self.origin = np.asarray(origin, dtype=float)
+
+    def bounds(self):
+        return self.origin - self.radius, self.origin + self.radius
+
+    def contains(self, positions):
+        offset = positions - self.origin[:, None]
+        return np.sum(offset**2, axis=0) <= self.radius**2
+
+
+class Cylinder:
+    """Cylinder of the given radius and height along `axis` (0, 1 or 2 for
+    x, y or z) centred on origin (um), e.g. a DBS lead"""
+
+    def __init__(self, radius, height, axis=1, origin=(0.0, 0.0, 0.0)):
+        self.radius = float(radius)
+        self.height = float(height)
+        self.axis = axis
+        self.origin = np.asarray(origin, dtype=float)
+
+    def bounds(self):
+        half_size = np.full(3, self.radius)
+        half_size[self.axis] = 0.5 * self.height
+        return self.origin - half_size, self.origin + half_size
+
+    def contains(self, positions):
+        offset = positions - self.origin[:, None]
+        radial = np.delete(offset, self.axis, axis=0)
+        return (np.sum(radial**2, axis=0) <= self.radius**2) & (
+            np.abs(offset[self.axis]) <= 0.5 * self.height
+        )
+
+
+def sample_positions(n, region, exclusions=(), seed=None, batch_size=None, max_batches=1000):
+    """Draw n positions uniformly from a region, outside the exclusion zones
+
+    Inputs:
+        n               - number of positions
+
+        region          - Cuboid, Sphere or Cylinder to place the cells in
+
+        exclusions      - geometries the cells must not be placed in
+
+        seed            - random seed, or a numpy Generator
+
+        batch_size      - number of candidate positions drawn at a time,
+                          estimated from the acceptance rate if None
+
+        max_batches     - largest number of batches before giving up
+
+    Returns a (3 x n) array of positions
+    """
+    rng = np.random.default_rng(seed)
+    low, high = region.bounds()
+    positions = np.empty((3, n))
+    n_accepted = 0
+    n_drawn = 0
+    for _ in range(max_batches):
+        if n_accepted == n:
+            return positions
+        if batch_size is None:
+            # Draw enough candidates for the remaining positions at the
+            # acceptance rate so far
+            acceptance = (n_accepted + 1) / (n_drawn + 1)
+            size = int(np.ceil(1.2 * (n - n_accepted) / acceptance)) + 16
+        else:
+            size = batch_size
+        candidates = rng.uniform(low[:, None], high[:, None], size=(3, size))
+        accepted = region.contains(candidates)
+        for exclusion in exclusions:
+            accepted &= ~exclusion.contains(candidates)
+        candidates = candidates[:, accepted][:, : n - n_accepted]
+        positions[:, n_accepted : n_accepted + candidates.shape[1]] = candidates
+        n_accepted += candidates.shape[1]
+        n_drawn += size
+    if n_accepted < n:
+        raise RuntimeError(
+            f"Only placed {n_accepted} of {n} cells in {max_batches} batches"
+        )
+    return positions
+
+
+def cortical_positions(n, seed=None):
+    """Positions of the cortical cells: an 8 mm cube centred on the
+    electrode, outside the stimulating/recording lead (-0.965 mm < x, z <
+    0.965 mm), with the somas at y = -2500 um so the axons extend to around
+    y = 5000 um"""
+    lead = Cuboid(2 * 965, np.inf, 2 * 965)
+    positions = sample_positions(n, Cuboid(8000, 8000, 8000), exclusions=[lead], seed=seed)
+    positions[1] = -2500
+    return positions
+
+
+def stn_positions(n, seed=None):
+    """Positions of the STN cells: 0 < x < 12 mm, -2 mm < y < 0,
+    -2 mm < z < 2 mm"""
+    return sample_positions(n, Cuboid(12000, 2000, 4000, origin=(6000, -1000, 0)), seed=seed)
+
+
+def xy_positions(positions):
+    """The (2 x n) array of x and y coordinates loaded by load_network from
+    cortical_xy_pos.txt and STN_xy_pos.txt"""
+    return np.asarray(positions)[:2]
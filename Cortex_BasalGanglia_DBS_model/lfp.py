@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Storage and computation of the STN local field potential used
+             by the closed-loop controller.
+"""
+
+import numpy as np
+from mpi4py import MPI
+from utils import RingBuffer, ChunkedArray
+
+
+class LFPStore:
+    """Preallocated storage for an LFP signal computed during the simulation.
+
+    The most recent `window_length` samples, which are all the biomarker
+    calculation needs, are kept in a ring buffer. The full signal history is
+    kept in fixed-size chunks and is only assembled into one array when it is
+    written out, so the cost of adding samples does not grow with run time.
+
+    Inputs:
+        window_length   - number of samples available through window()
+
+        chunk_size      - number of samples per history chunk
+    """
+
+    def __init__(self, window_length, chunk_size=2**16):
+        self.window_length = int(window_length)
+        self._window = RingBuffer(self.window_length)
+        self._history = ChunkedArray(chunk_size)
+
+    def __len__(self):
+        return len(self._history)
+
+    def append(self, samples):
+        """Add newly computed LFP samples"""
+        samples = np.asarray(samples, dtype=np.float64).ravel()
+        self._window.append(samples)
+        self._history.append(samples)
+
+    def window(self):
+        """Return the last `window_length` samples (or fewer, if fewer have
+        been stored) as a read-only view, oldest sample first"""
+        return self._window.view()
+
+    def to_array(self):
+        """Return the full LFP signal recorded so far"""
+        return self._history.to_array()
+
+
+class LFPKernel:
+    """Precomputed electrode weights for the differential STN LFP.
+
+    For a point source in a homogeneous, isotropic medium the potential at an
+    electrode is I / (4 * pi * sigma * r). The LFP is recorded differentially
+    between two electrodes, so each cell contributes its synaptic current
+    weighted by a single coefficient (1/r1 - 1/r2) / (4 * pi * sigma).
+
+    Inputs:
+        electrode_1_distances,
+        electrode_2_distances   - distances of the local cells to each
+                                  recording electrode (um)
+
+        sigma                   - conductivity of the tissue (S/m)
+
+        components              - which LFP signals compute() returns; any of
+                                  "total", "AMPA" and "GABAa"
+    """
+
+    allowed_components = ("total", "AMPA", "GABAa")
+
+    def __init__(
+        self,
+        electrode_1_distances,
+        electrode_2_distances,
+        sigma=0.27,
+        components=("total",),
+    ):
+        for component in components:
+            if component not in self.allowed_components:
+                raise ValueError(f"Unknown LFP component: {component}")
+        self.components = tuple(components)
+        self.sigma = sigma
+
+        # Distances are in um and currents in nA -> LFP in mV
+        d1 = np.asarray(electrode_1_distances, dtype=np.float64).ravel() * 1e-6
+        d2 = np.asarray(electrode_2_distances, dtype=np.float64).ravel() * 1e-6
+        self.weights = (1e-6 / (4 * np.pi * sigma)) * (1 / d1 - 1 / d2)
+        # Scratch row for the GABAa LFP when it is only needed for the total
+        self._scratch = np.empty(0)
+
+    def __len__(self):
+        return len(self.components)
+
+    def compute(self, ampa_i, gabaa_i, out=None):
+        """Calculate the LFP components from the synaptic currents
+
+        Inputs:
+            ampa_i, gabaa_i     - synaptic currents of the local cells
+                                  (samples x cells, nA)
+
+            out                 - optional C-contiguous array of shape
+                                  (len(components), samples) to write into
+
+        Returns the LFP components in the order given by `components`
+        """
+        ampa_i = np.asarray(ampa_i, dtype=np.float64)
+        gabaa_i = np.asarray(gabaa_i, dtype=np.float64)
+        n_samples = ampa_i.shape[0]
+        if out is None:
+            out = np.empty((len(self.components), n_samples))
+
+        rows = {c: out[k] for k, c in enumerate(self.components)}
+        ampa = rows.get("AMPA")
+        gabaa = rows.get("GABAa")
+        total = rows.get("total")
+        if ampa is not None:
+            np.dot(ampa_i, self.weights, out=ampa)
+        if gabaa is not None:
+            np.dot(gabaa_i, self.weights, out=gabaa)
+        if total is not None:
+            if gabaa is None:
+                if len(self._scratch) < n_samples:
+                    self._scratch = np.empty(n_samples)
+                gabaa = self._scratch[:n_samples]
+                np.dot(gabaa_i, self.weights, out=gabaa)
+            if ampa is not None:
+                np.add(ampa, gabaa, out=total)
+            else:
+                np.dot(ampa_i, self.weights, out=total)
+                total += gabaa
+
+        return out
+
+
+class LFPReducer:
+    """Sums the partial LFPs calculated on each MPI rank.
+
+    All LFP components are packed into one contiguous, preallocated buffer and
+    summed with a single buffer-based collective per controller call, instead
+    of one pickle-based allreduce per component.
+
+    Inputs:
+        comm            - MPI communicator
+
+        n_components    - number of LFP components reduced per call
+
+        root            - rank which receives the result, or None for every
+                          rank to receive it
+    """
+
+    def __init__(self, comm, n_components, root=None):
+        self.comm = comm
+        self.n_components = int(n_components)
+        self.root = root
+        self._buffer = np.zeros(0)
+
+    def buffer(self, n_samples):
+        """Return a C-contiguous (n_components x n_samples) view of the
+        reduction buffer, for the partial LFPs to be written into"""
+        size = self.n_components * n_samples
+        if self._buffer.size < size:
+            self._buffer = np.empty(size)
+        return self._buffer[:size].reshape(self.n_components, n_samples)
+
+    def reduce(self, partial):
+        """Sum a buffer returned by buffer() over all ranks, in place
+
+        Returns the summed LFP components, or None on ranks which do not
+        receive the result
+        """
+        flat = partial.reshape(-1)
+        if self.root is None:
+            self.comm.Allreduce(MPI.IN_PLACE, flat, op=MPI.SUM)
+            return partial
+        if self.comm.Get_rank() == self.root:
+            self.comm.Reduce(MPI.IN_PLACE, flat, op=MPI.SUM, root=self.root)
+            return partial
+        self.comm.Reduce(flat, None, op=MPI.SUM, root=self.root)
+        return None
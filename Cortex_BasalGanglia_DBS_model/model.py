@@ -5,10 +5,10 @@ from pyNN.neuron import (
     Population,
     StepCurrentSource,
     SpikeSourceArray,
-    DCSource,
     Projection,
     StaticSynapse,
     FromFileConnector,
+    FromListConnector,
     NoisyCurrentSource,
     FixedNumberPreConnector,
 )
@@ -21,10 +21,20 @@ from Cortical_Basal_Ganglia_Cell_Classes import (
     Thalamic_Neuron_Type,
 )
 from Electrode_Distances import (
-    distances_to_electrode,
+    electrode_distances,
     collateral_distances_to_electrode,
 )
 import utils as u
+import layout
+import modulation
+from current_sources import PopulationCurrentSource, inject_membrane_noise
+from network_bundle import NetworkBundle, PROJECTION_FILES
+from connectivity import (
+    ArrayConnector,
+    PROJECTION_SPECS,
+    generate_connections,
+    scale_stimulation_order,
+)
 from pathlib import Path
 
 
@@ -126,21 +136,19 @@ def create_network(
     Striatal_Pop.set(spike_times=striatal_spike_times[:, 0])
 
     # Load burst times
-    burst_dir = Path("burst_data")
-    burst_times_script = burst_dir / "burst_times_1.txt"
-    burst_level_script = burst_dir / "burst_level_1.txt"
-    modulation_t = np.loadtxt(burst_times_script, delimiter=",")
-    modulation_s = np.loadtxt(burst_level_script, delimiter=",")
+    modulation_t, modulation_s = modulation.burst_scenario(config.burst_scenario)
     modulation_s = beta_burst_modulation_scale * modulation_s  # Scale the modulation signal
     cortical_modulation_current = StepCurrentSource(
         times=modulation_t, amplitudes=modulation_s
     )
     Cortical_Pop.inject(cortical_modulation_current)
     if ctx_dc_offset > 0:
-        Cortical_Pop.inject(
-            DCSource(start=steady_state_duration,
-                     stop=sim_total_time,
-                     amplitude=ctx_dc_offset))
+        PopulationCurrentSource(
+            Cortical_Pop,
+            ctx_dc_offset,
+            start=steady_state_duration,
+            stop=sim_total_time,
+        )
 
     add_slow_modulation(
         Cortical_Pop,
@@ -150,61 +158,30 @@ def create_network(
         sim_total_time
     )
 
-    # Generate Noisy current sources for cortical pyramidal and interneuron populations
+    # Generate membrane noise currents for cortical pyramidal and interneuron populations
     # Inject each membrane noise current into each cortical and interneuron in network
-    for cell in Cortical_Pop:
-        cell.inject(
-            NoisyCurrentSource(
-                mean=0,
-                stdev=0.005,
-                start=steady_state_duration,
-                stop=sim_total_time,
-                dt=1.0,
-            )
-        )
-
-    for cell in Interneuron_Pop:
-        cell.inject(
-            NoisyCurrentSource(
-                mean=0,
-                stdev=0.005,
-                start=steady_state_duration,
-                stop=sim_total_time,
-                dt=1.0,
-            )
+    for population in (Cortical_Pop, Interneuron_Pop):
+        add_membrane_noise(
+            population,
+            steady_state_duration,
+            sim_total_time,
+            rng_seed,
+            config.membrane_noise,
         )
 
-    # Position Check -
-    # 1) Make sure cells are bounded in 8mm cubic space in x and z coordinates
-    # 2) Make sure no cells are placed inside the stimulating/recording lead -0.965mm < x < 0.965mm and -0.965mm < z < 0.965mm
-
-    for Cortical_cell in Cortical_Pop:
-        while (
-                (np.abs(Cortical_cell.position[0]) > 4000)  # Check if x is within bounds
-                or (np.abs(Cortical_cell.position[2]) > 4000)  # Check if z is within bounds
-                or (
-                        (Cortical_cell.position[0] < 965 and Cortical_cell.position[0] > -965)  # Lead condition for x
-                        and (Cortical_cell.position[2] < 965 and Cortical_cell.position[2] > -965) # Lead condition for z
-                )
-        ):
-            Cortical_cell.position = Cortical_space.generate_positions(1).flatten()
-        Cortical_cell.position[1] = -2500  # Axon will extend from -2500 to around 5000.
+    # Position the cells - cortical cells are placed in the 8mm cubic space,
+    # outside the stimulating/recording lead -0.965mm < x < 0.965mm and
+    # -0.965mm < z < 0.965mm, STN cells in 0 < x < 12mm, -2mm < y < 0
+    Cortical_Pop.positions = layout.cortical_positions(Pop_size, seed=[rng_seed, 0])
+    STN_Pop.positions = layout.stn_positions(Pop_size, seed=[rng_seed, 1])
 
-    # Save the generated cortical xy positions to a text file
+    # Save the generated positions to text files, the xy positions in the
+    # format read by load_network
     np.savetxt(structure_save_dir / "cortical_xyz_cell_distribution.txt", Cortical_Pop.positions.T, delimiter=",")
+    np.savetxt(structure_save_dir / "cortical_xy_pos.txt", layout.xy_positions(Cortical_Pop.positions), delimiter=",")
     print("Finished assigning the cortical cells.. ")
-    for STN_cell in STN_Pop:
-        while (
-                (STN_cell.position[0] > 12000)  # Check if x is within bounds
-                or (STN_cell.position[0] < 0)  # Check if x is less than 0
-                or (STN_cell.position[1] > 0)  # Check if y is within bounds (should be less than 0)
-                or (np.abs(STN_cell.position[2]) > 2000)  # Check if z is within bounds
-                or (STN_cell.position[1] < -4000)  # Check if y is within bounds
-        ):
-            STN_cell.position = STN_space.generate_positions(1).flatten()
-
-    # Save the generated STN xy positions to a text file
     np.savetxt(structure_save_dir / "STN_xyz_cell_distribution.txt", STN_Pop.positions.T, delimiter=",")
+    np.savetxt(structure_save_dir / "STN_xy_pos.txt", layout.xy_positions(STN_Pop.positions), delimiter=",")
     print("Finished assigning the STN cells.. ")
 
     # Synaptic Connections
@@ -238,7 +215,7 @@ def create_network(
     prj_CorticalAxon_Interneuron = Projection(
         Cortical_Pop,
         Interneuron_Pop,
-        FixedNumberPreConnector(n=10, allow_self_connections=False),
+        new_connector("CorticalAxonInterneuron", Cortical_Pop, Interneuron_Pop, rng_seed, config.procedural_connectivity),
         syn_CorticalAxon_Interneuron,
         source="middle_axon_node",
         receptor_type="AMPA",
@@ -246,14 +223,14 @@ def create_network(
     prj_Interneuron_CorticalSoma = Projection(
         Interneuron_Pop,
         Cortical_Pop,
-        FixedNumberPreConnector(n=10, allow_self_connections=False),
+        new_connector("InterneuronCortical", Interneuron_Pop, Cortical_Pop, rng_seed, config.procedural_connectivity),
         syn_Interneuron_CorticalSoma,
         receptor_type="GABAa",
     )
     prj_CorticalSTN = Projection(
         Cortical_Pop,
         STN_Pop,
-        FixedNumberPreConnector(n=5, allow_self_connections=False),
+        new_connector("CorticalSTN", Cortical_Pop, STN_Pop, rng_seed, config.procedural_connectivity),
         syn_CorticalCollateralSTN,
         source="collateral(0.5)",
         receptor_type="AMPA",
@@ -261,7 +238,7 @@ def create_network(
     prj_STNGPe = Projection(
         STN_Pop,
         GPe_Pop,
-        FixedNumberPreConnector(n=1, allow_self_connections=False),
+        new_connector("STNGPe", STN_Pop, GPe_Pop, rng_seed, config.procedural_connectivity),
         syn_STNGPe,
         source="soma(0.5)",
         receptor_type="AMPA",
@@ -269,7 +246,7 @@ def create_network(
     prj_GPeGPe = Projection(
         GPe_Pop,
         GPe_Pop,
-        FixedNumberPreConnector(n=1, allow_self_connections=False),
+        new_connector("GPeGPe", GPe_Pop, GPe_Pop, rng_seed, config.procedural_connectivity),
         syn_GPeGPe,
         source="soma(0.5)",
         receptor_type="GABAa",
@@ -277,7 +254,7 @@ def create_network(
     prj_GPeSTN = Projection(
         GPe_Pop,
         STN_Pop,
-        FixedNumberPreConnector(n=2, allow_self_connections=False),
+        new_connector("GPeSTN", GPe_Pop, STN_Pop, rng_seed, config.procedural_connectivity),
         syn_GPeSTN,
         source="soma(0.5)",
         receptor_type="GABAa",
@@ -285,7 +262,7 @@ def create_network(
     prj_StriatalGPe = Projection(
         Striatal_Pop,
         GPe_Pop,
-        FixedNumberPreConnector(n=1, allow_self_connections=False),
+        new_connector("StriatalGPe", Striatal_Pop, GPe_Pop, rng_seed, config.procedural_connectivity),
         syn_StriatalGPe,
         source="soma(0.5)",
         receptor_type="GABAa",
@@ -293,7 +270,7 @@ def create_network(
     prj_STNGPi = Projection(
         STN_Pop,
         GPi_Pop,
-        FixedNumberPreConnector(n=1, allow_self_connections=False),
+        new_connector("STNGPi", STN_Pop, GPi_Pop, rng_seed, config.procedural_connectivity),
         syn_STNGPi,
         source="soma(0.5)",
         receptor_type="AMPA",
@@ -301,7 +278,7 @@ def create_network(
     prj_GPeGPi = Projection(
         GPe_Pop,
         GPi_Pop,
-        FixedNumberPreConnector(n=1, allow_self_connections=False),
+        new_connector("GPeGPi", GPe_Pop, GPi_Pop, rng_seed, config.procedural_connectivity),
         syn_GPeGPi,
         source="soma(0.5)",
         receptor_type="GABAa",
@@ -309,7 +286,7 @@ def create_network(
     prj_GPiThalamic = Projection(
         GPi_Pop,
         Thalamic_Pop,
-        FixedNumberPreConnector(n=1, allow_self_connections=False),
+        new_connector("GPiThalamic", GPi_Pop, Thalamic_Pop, rng_seed, config.procedural_connectivity),
         syn_GPiThalamic,
         source="soma(0.5)",
         receptor_type="GABAa",
@@ -317,7 +294,7 @@ def create_network(
     prj_ThalamicCortical = Projection(
         Thalamic_Pop,
         Cortical_Pop,
-        FixedNumberPreConnector(n=1, allow_self_connections=False),
+        new_connector("ThalamicCorticalSoma", Thalamic_Pop, Cortical_Pop, rng_seed, config.procedural_connectivity),
         syn_ThalamicCortical,
         source="soma(0.5)",
         receptor_type="AMPA",
@@ -325,7 +302,7 @@ def create_network(
     prj_CorticalThalamic = Projection(
         Cortical_Pop,
         Thalamic_Pop,
-        FixedNumberPreConnector(n=1, allow_self_connections=False),
+        new_connector("CorticalSomaThalamic", Cortical_Pop, Thalamic_Pop, rng_seed, config.procedural_connectivity),
         syn_CorticalThalamic,
         source="soma(0.5)",
         receptor_type="AMPA",
@@ -351,7 +328,7 @@ def create_network(
     # prj_CorticalThalamic.saveConnections(file=structure_save_dir / "CorticalSomaThalamic_Connections.txt")
     # Load GPe stimulation order
     GPe_stimulation_order = np.loadtxt(structure_save_dir / "GPe_Stimulation_Order.txt", delimiter=",")
-    GPe_stimulation_order = [int(index) for index in GPe_stimulation_order]
+    GPe_stimulation_order = scale_stimulation_order(GPe_stimulation_order, Pop_size, rng_seed)
 
     return (
         striatal_spike_times,
@@ -378,6 +355,37 @@ def create_network(
     )
 
 
+def new_connector(projection, pre_population, post_population, seed, procedural=False):
+    """Connector for a new projection: a pyNN FixedNumberPreConnector, or
+    with procedural=True the connections onto the local cells of
+    post_population generated from the seed (see
+    connectivity.generate_connections)"""
+    spec = PROJECTION_SPECS[projection]
+    if not procedural:
+        return FixedNumberPreConnector(n=spec["n"], allow_self_connections=False)
+    post_indices = post_population.id_to_index(post_population.local_cells)
+    return ArrayConnector(
+        generate_connections(projection, seed, post_indices, pre_population.size)
+    )
+
+
+def load_connector(structure_save_dir, bundle, projection, post_population, array_connector=True):
+    """Connector for a saved projection, from its text file or, for the
+    connections onto the local cells of post_population, from the network
+    bundle. With array_connector=False the pyNN FromFileConnector and
+    FromListConnector are used instead of ArrayConnector."""
+    if bundle is None:
+        if not array_connector:
+            return FromFileConnector(str(structure_save_dir / PROJECTION_FILES[projection]))
+        connections = np.loadtxt(structure_save_dir / PROJECTION_FILES[projection], ndmin=2)
+    else:
+        post_indices = post_population.id_to_index(post_population.local_cells)
+        connections = bundle.connections(projection, post_indices)
+        if not array_connector:
+            return FromListConnector(connections, column_names=["weight", "delay"])
+    return ArrayConnector(connections)
+
+
 def load_network(
     steady_state_duration,
     sim_total_time,
@@ -409,13 +417,27 @@ def load_network(
         boundary=space.Sphere(2000), rng=NumpyRNG(seed=rng_seed)
     )
 
+    # Load the network structure from the binary bundle if one is configured,
+    # otherwise from the text files
+    if config.network_bundle:
+        bundle = NetworkBundle(config.network_bundle, verify=config.network_bundle_verify)
+    else:
+        bundle = None
+
     # Load striatal spike times from file
-    striatal_spike_times = np.load(structure_save_dir / "Striatal_Spike_Times.npy", allow_pickle=True)
-    Pop_size = len(striatal_spike_times[:, 0])
-    for i in range(Pop_size):
-        spike_times = striatal_spike_times[i][0].value
-        spike_times = spike_times[spike_times > steady_state_duration]
-        striatal_spike_times[i][0] = Sequence(spike_times)
+    if bundle is not None:
+        Pop_size = bundle.pop_size
+        striatal_spike_times = np.empty((Pop_size, 1), dtype=object)
+        for i, spike_times in enumerate(bundle.spike_times()):
+            spike_times = spike_times[spike_times > steady_state_duration]
+            striatal_spike_times[i][0] = Sequence(spike_times)
+    else:
+        striatal_spike_times = np.load(structure_save_dir / "Striatal_Spike_Times.npy", allow_pickle=True)
+        Pop_size = len(striatal_spike_times[:, 0])
+        for i in range(Pop_size):
+            spike_times = striatal_spike_times[i][0].value
+            spike_times = spike_times[spike_times > steady_state_duration]
+            striatal_spike_times[i][0] = Sequence(spike_times)
 
     # Generate the cortico-basal ganglia neuron populations
     Cortical_Pop = Population(
@@ -464,41 +486,23 @@ def load_network(
 
     Striatal_Pop.set(spike_times=striatal_spike_times[:, 0])
 
-    # Generate Noisy current sources for cortical pyramidal and interneuron populations
+    # Generate membrane noise currents for cortical pyramidal and interneuron populations
     # Inject each membrane noise current into each cortical and interneuron in network
-    for cell in Cortical_Pop:
-        cell.inject(
-            NoisyCurrentSource(
-                mean=0,
-                stdev=0.005,
-                start=steady_state_duration,
-                stop=sim_total_time,
-                dt=1.0,
-            )
-        )
-
-    for cell in Interneuron_Pop:
-        cell.inject(
-            NoisyCurrentSource(
-                mean=0,
-                stdev=0.005,
-                start=steady_state_duration,
-                stop=sim_total_time,
-                dt=1.0,
-            )
+    for population in (Cortical_Pop, Interneuron_Pop):
+        add_membrane_noise(
+            population,
+            steady_state_duration,
+            sim_total_time,
+            rng_seed,
+            config.membrane_noise,
         )
 
     # Load burst times
-    burst_dir = Path("burst_data")
-    burst_times_script = burst_dir / "burst_times_1.txt"
-    burst_level_script = burst_dir / "burst_level_1.txt"
-    modulation_t = np.loadtxt(burst_times_script, delimiter=",")
-    modulation_s = np.loadtxt(burst_level_script, delimiter=",")
+    modulation_t, modulation_s = modulation.burst_scenario(config.burst_scenario)
 
-    while modulation_t[-1] < sim_total_time:
-        time_shift = int(modulation_t[-1] - modulation_t[0] + np.mean(np.diff(modulation_t)))
-        modulation_t = np.hstack((modulation_t, time_shift + modulation_t))
-        modulation_s = np.hstack((modulation_s, modulation_s))
+    modulation_t, modulation_s = modulation.tile_modulation(
+        modulation_t, modulation_s, sim_total_time
+    )
 
     if modulation_t[0] > sim_total_time:
         time_shift = int(steady_state_duration - modulation_t[0])
@@ -506,29 +510,31 @@ def load_network(
 
     random_array = np.random.randn(Pop_size)
 
-    for cell in Cortical_Pop:
-        cell_offset = ctx_dc_offset
-        if config.ctx_dc_offset_std > 0:
-            cell_offset += config.ctx_dc_offset_std * random_array[cell]
-        cell.inject(
-            DCSource(
-                start=steady_state_duration,
-                stop=sim_total_time,
-                amplitude=cell_offset))
+    cell_offsets = np.full(Pop_size, ctx_dc_offset, dtype=float)
+    if config.ctx_dc_offset_std > 0:
+        cell_offsets += config.ctx_dc_offset_std * random_array
+    PopulationCurrentSource(
+        Cortical_Pop,
+        cell_offsets,
+        start=steady_state_duration,
+        stop=sim_total_time,
+    )
 
     if ctx_beta_spike_input:
-        ctx_poisson_tt, ctx_poisson_a = u.burst_txt_to_signal(modulation_t, ctx_beta_frequency * (modulation_s + 1), steady_state_duration, sim_total_time, dt=0.1)
-        ctx_spike_times = u.generate_inhomogeneous_poisson_spike_times(
+        # Spike trains with the burst modulated firing rate, generated from
+        # the steps of the modulation
+        ctx_spike_trains = u.inhomogeneous_poisson_spike_trains(
             Pop_size,
-            ctx_poisson_tt,
-            ctx_poisson_a,
-            dt=0.1,
+            modulation_t,
+            ctx_beta_frequency * (modulation_s + 1),
+            steady_state_duration,
+            sim_total_time,
             random_seed=rng_seed,
             isi_dither=ctx_beta_isi_dither,
         )
         Ctx_Beta_Source_Pop = Population(
             Pop_size,
-            SpikeSourceArray(spike_times=ctx_spike_times[0]),
+            SpikeSourceArray(spike_times=ctx_spike_trains.sequence(0)),
             label="Ctx Beta Spike Source",
             )
         syn_Ctx_Beta = StaticSynapse(weight=ctx_beta_synapse_strength, delay=1)
@@ -557,7 +563,10 @@ def load_network(
         )
 
     # Load cortical positions - Comment/Remove to generate new positions
-    Cortical_Neuron_xy_Positions = np.loadtxt(structure_save_dir / "cortical_xy_pos.txt", delimiter=",")
+    if bundle is not None:
+        Cortical_Neuron_xy_Positions = bundle.positions("cortical_xy_pos")
+    else:
+        Cortical_Neuron_xy_Positions = np.loadtxt(structure_save_dir / "cortical_xy_pos.txt", delimiter=",")
     cortex_local_indices = [cell in Cortical_Pop for cell in Cortical_Pop.all_cells]
     Cortical_Neuron_x_Positions = Cortical_Neuron_xy_Positions[0, cortex_local_indices]
     Cortical_Neuron_y_Positions = Cortical_Neuron_xy_Positions[1, cortex_local_indices]
@@ -568,7 +577,10 @@ def load_network(
         cell.position[1] = Cortical_Neuron_y_Positions[ii]
 
     # Load STN positions - Comment/Remove to generate new positions
-    STN_Neuron_xy_Positions = np.loadtxt(structure_save_dir / "STN_xy_pos.txt", delimiter=",")
+    if bundle is not None:
+        STN_Neuron_xy_Positions = bundle.positions("STN_xy_pos")
+    else:
+        STN_Neuron_xy_Positions = np.loadtxt(structure_save_dir / "STN_xy_pos.txt", delimiter=",")
     stn_local_indices = [cell in STN_Pop for cell in STN_Pop.all_cells]
     STN_Neuron_x_Positions = STN_Neuron_xy_Positions[0, stn_local_indices]
     STN_Neuron_y_Positions = STN_Neuron_xy_Positions[1, stn_local_indices]
@@ -610,7 +622,7 @@ def load_network(
     prj_CorticalAxon_Interneuron = Projection(
         Cortical_Pop,
         Interneuron_Pop,
-        FromFileConnector(str(structure_save_dir / "CorticalAxonInterneuron_Connections.txt")),
+        load_connector(structure_save_dir, bundle, "CorticalAxonInterneuron", Interneuron_Pop, config.array_connectors),
         syn_CorticalAxon_Interneuron,
         source="middle_axon_node",
         receptor_type="AMPA",
@@ -618,14 +630,14 @@ def load_network(
     prj_Interneuron_CorticalSoma = Projection(
         Interneuron_Pop,
         Cortical_Pop,
-        FromFileConnector(str(structure_save_dir / "InterneuronCortical_Connections.txt")),
+        load_connector(structure_save_dir, bundle, "InterneuronCortical", Cortical_Pop, config.array_connectors),
         syn_Interneuron_CorticalSoma,
         receptor_type="GABAa",
     )
     prj_CorticalSTN = Projection(
         Cortical_Pop,
         STN_Pop,
-        FromFileConnector(str(structure_save_dir / "CorticalSTN_Connections.txt")),
+        load_connector(structure_save_dir, bundle, "CorticalSTN", STN_Pop, config.array_connectors),
         syn_CorticalCollateralSTN,
         source="collateral(0.5)",
         receptor_type="AMPA",
@@ -633,7 +645,7 @@ def load_network(
     prj_STNGPe = Projection(
         STN_Pop,
         GPe_Pop,
-        FromFileConnector(str(structure_save_dir / "STNGPe_Connections.txt")),
+        load_connector(structure_save_dir, bundle, "STNGPe", GPe_Pop, config.array_connectors),
         syn_STNGPe,
         source="soma(0.5)",
         receptor_type="AMPA",
@@ -641,7 +653,7 @@ def load_network(
     prj_GPeGPe = Projection(
         GPe_Pop,
         GPe_Pop,
-        FromFileConnector(str(structure_save_dir / "GPeGPe_Connections.txt")),
+        load_connector(structure_save_dir, bundle, "GPeGPe", GPe_Pop, config.array_connectors),
         syn_GPeGPe,
         source="soma(0.5)",
         receptor_type="GABAa",
@@ -649,7 +661,7 @@ def load_network(
     prj_GPeSTN = Projection(
         GPe_Pop,
         STN_Pop,
-        FromFileConnector(str(structure_save_dir / "GPeSTN_Connections.txt")),
+        load_connector(structure_save_dir, bundle, "GPeSTN", STN_Pop, config.array_connectors),
         syn_GPeSTN,
         source="soma(0.5)",
         receptor_type="GABAa",
@@ -657,7 +669,7 @@ def load_network(
     prj_StriatalGPe = Projection(
         Striatal_Pop,
         GPe_Pop,
-        FromFileConnector(str(structure_save_dir / "StriatalGPe_Connections.txt")),
+        load_connector(structure_save_dir, bundle, "StriatalGPe", GPe_Pop, config.array_connectors),
         syn_StriatalGPe,
         source="soma(0.5)",
         receptor_type="GABAa",
@@ -665,7 +677,7 @@ def load_network(
     prj_STNGPi = Projection(
         STN_Pop,
         GPi_Pop,
-        FromFileConnector(str(structure_save_dir / "STNGPi_Connections.txt")),
+        load_connector(structure_save_dir, bundle, "STNGPi", GPi_Pop, config.array_connectors),
         syn_STNGPi,
         source="soma(0.5)",
         receptor_type="AMPA",
@@ -673,7 +685,7 @@ def load_network(
     prj_GPeGPi = Projection(
         GPe_Pop,
         GPi_Pop,
-        FromFileConnector(str(structure_save_dir / "GPeGPi_Connections.txt")),
+        load_connector(structure_save_dir, bundle, "GPeGPi", GPi_Pop, config.array_connectors),
         syn_GPeGPi,
         source="soma(0.5)",
         receptor_type="GABAa",
@@ -681,7 +693,7 @@ def load_network(
     prj_GPiThalamic = Projection(
         GPi_Pop,
         Thalamic_Pop,
-        FromFileConnector(str(structure_save_dir / "GPiThalamic_Connections.txt")),
+        load_connector(structure_save_dir, bundle, "GPiThalamic", Thalamic_Pop, config.array_connectors),
         syn_GPiThalamic,
         source="soma(0.5)",
         receptor_type="GABAa",
@@ -689,7 +701,7 @@ def load_network(
     prj_ThalamicCortical = Projection(
         Thalamic_Pop,
         Cortical_Pop,
-        FromFileConnector(str(structure_save_dir / "ThalamicCorticalSoma_Connections.txt")),
+        load_connector(structure_save_dir, bundle, "ThalamicCorticalSoma", Cortical_Pop, config.array_connectors),
         syn_ThalamicCortical,
         source="soma(0.5)",
         receptor_type="AMPA",
@@ -697,15 +709,18 @@ def load_network(
     prj_CorticalThalamic = Projection(
         Cortical_Pop,
         Thalamic_Pop,
-        FromFileConnector(str(structure_save_dir / "CorticalSomaThalamic_Connections.txt")),
+        load_connector(structure_save_dir, bundle, "CorticalSomaThalamic", Thalamic_Pop, config.array_connectors),
         syn_CorticalThalamic,
         source="soma(0.5)",
         receptor_type="AMPA",
     )
 
     # Load GPe stimulation order
-    GPe_stimulation_order = np.loadtxt(structure_save_dir / "GPe_Stimulation_Order.txt", delimiter=",")
-    GPe_stimulation_order = [int(index) for index in GPe_stimulation_order]
+    if bundle is not None:
+        GPe_stimulation_order = bundle.stimulation_order()
+    else:
+        GPe_stimulation_order = np.loadtxt(structure_save_dir / "GPe_Stimulation_Order.txt", delimiter=",")
+        GPe_stimulation_order = [int(index) for index in GPe_stimulation_order]
 
     return (
         Pop_size,
@@ -742,12 +757,12 @@ def electrode_distance(
 ):
     # Calculate STN cell distances to each recording electrode
     # using only xy coordinates for distance calculations
-    STN_recording_electrode_1_distances = distances_to_electrode(
-        recording_electrode_1_position, STN_Pop
-    )
-    STN_recording_electrode_2_distances = distances_to_electrode(
-        recording_electrode_2_position, STN_Pop
+    STN_recording_electrode_distances = electrode_distances(
+        [recording_electrode_1_position, recording_electrode_2_position],
+        STN_Pop.positions[:, STN_Pop._mask_local],
     )
+    STN_recording_electrode_1_distances = STN_recording_electrode_distances[0].reshape(-1, 1)
+    STN_recording_electrode_2_distances = STN_recording_electrode_distances[1].reshape(-1, 1)
 
     # Calculate Cortical Collateral distances from the stimulating electrode -
     # using xyz coordinates for distance
@@ -765,20 +780,48 @@ def electrode_distance(
     )
 
 
+def add_membrane_noise(population, start, stop, seed, mechanism="point_process"):
+    """Inject membrane noise (mean 0 nA, stdev 0.005 nA, a new sample every
+    1 ms) into every cell of a population, drawn on the fly by a
+    MembraneNoise point process per cell, or played from a pyNN
+    NoisyCurrentSource per cell with mechanism="current_source"."""
+    if mechanism == "current_source":
+        for cell in population:
+            cell.inject(
+                NoisyCurrentSource(
+                    mean=0,
+                    stdev=0.005,
+                    start=start,
+                    stop=stop,
+                    dt=1.0,
+                )
+            )
+    else:
+        inject_membrane_noise(
+            population, mean=0, stdev=0.005, start=start, stop=stop, dt=1.0, seed=seed
+        )
+
+
 def add_slow_modulation(Population, amplitude, step_count, steady_state_duration, sim_total_time):
     if abs(amplitude) > 0:
         slow_modulation_start = steady_state_duration
         slow_modulation_stage_duration = (
             (sim_total_time - slow_modulation_start) / (step_count + 1)
             )
+        # Every other stage is on, as one step-wise current for all cells
+        stage_times = []
+        stage_amplitudes = []
         for i in range(step_count + 1):
             stage_start = slow_modulation_start + i * slow_modulation_stage_duration
             stage_end = stage_start + slow_modulation_stage_duration
             stage_amplitude = amplitude * ((i) % 2)
             if stage_amplitude == 0:
                 continue
-            Population.inject(DCSource(
-                start=stage_start,
-                stop=stage_end,
-                amplitude=stage_amplitude
-            ))
+            stage_times += [stage_start, stage_end]
+            stage_amplitudes += [stage_amplitude, 0.0]
+        if stage_times:
+            PopulationCurrentSource(
+                Population,
+                stage_amplitudes,
+                times=stage_times,
+            )
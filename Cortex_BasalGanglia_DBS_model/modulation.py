@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Cortical beta burst modulation scenarios.
+
+             burst_data/ holds ten scenarios of the beta burst modulation,
+             burst_times_<n>.txt and burst_level_<n>.txt, the times (ms) and
+             levels of the steps of the modulation. The text files are
+             parsed once into burst_data/burst_library.npz, which is rebuilt
+             when a text file is newer than it, and the library is kept in
+             memory for the rest of the run.
+
+             tile_modulation() repeats a scenario to cover a run, giving the
+             same steps as repeatedly appending a shifted copy of the
+             sequence to itself.
+"""
+
+import os
+from pathlib import Path
+
+import numpy as np
+
+BURST_DIR = Path("burst_data")
+LIBRARY_FILE = "burst_library.npz"
+SCENARIOS = range(1, 11)
+
+# Library loaded in this process, by burst data directory
+_libraries = {}
+
+
+def _scenario_files(burst_dir, scenario):
+    return (
+        burst_dir / f"burst_times_{scenario}.txt",
+        burst_dir / f"burst_level_{scenario}.txt",
+    )
+
+
+def _library_is_current(burst_dir, library_path):
+    if not library_path.exists():
+        return False
+    library_mtime = library_path.stat().st_mtime
+    return all(
+        path.stat().st_mtime <= library_mtime
+        for scenario in SCENARIOS
+        for path in _scenario_files(burst_dir, scenario)
+    )
+
+
+def build_burst_library(burst_dir=BURST_DIR):
+    """Parse the text files of all scenarios in burst_dir and save them to
+    the library file, returns a dictionary of scenario to (times, levels)"""
+    burst_dir = Path(burst_dir)
+    library = {}
+    arrays = {}
+    for scenario in SCENARIOS:
+        times_file, level_file = _scenario_files(burst_dir, scenario)
+        times = np.loadtxt(times_file, delimiter=",")
+        levels = np.loadtxt(level_file, delimiter=",")
+        library[scenario] = (times, levels)
+        arrays[f"times_{scenario}"] = times
+        arrays[f"levels_{scenario}"] = levels
+
+    # Written under a temporary name first, so other ranks never read a
+    # partly written library
+    library_path = burst_dir / LIBRARY_FILE
+    temporary_path = burst_dir / f".{LIBRARY_FILE}.{os.getpid()}.npz"
+    np.savez(temporary_path, **arrays)
+    os.replace(temporary_path, library_path)
+    return library
+
+
+def load_burst_library(burst_dir=BURST_DIR):
+    """Dictionary of scenario number to the (times, levels) arrays of its
+    modulation steps"""
+    burst_dir = Path(burst_dir)
+    key = burst_dir.resolve()
+    if key not in _libraries:
+        library_path = burst_dir / LIBRARY_FILE
+        if _library_is_current(burst_dir, library_path):
+            with np.load(library_path) as arrays:
+                _libraries[key] = {
+                    scenario: (arrays[f"times_{scenario}"], arrays[f"levels_{scenario}"])
+                    for scenario in SCENARIOS
+                }
+        else:
+            _libraries[key] = build_burst_library(burst_dir)
+    return _libraries[key]
+
+
+def burst_scenario(scenario, burst_dir=BURST_DIR):
+    """Copies of the (times, levels) arrays of a scenario (1 to 10)"""
+    library = load_burst_library(burst_dir)
+    if scenario not in library:
+        raise ValueError(f"Unknown burst scenario: {scenario}")
+    times, levels = library[scenario]
+    return times.copy(), levels.copy()
+
+
+def tile_modulation(times, levels, tstop):
+    """Repeat the modulation steps until the last step is at or after tstop
+
+    Each repeat appends a copy of the whole sequence so far, shifted by its
+    span plus its mean step interval (truncated to an integer). The shifts
+    only depend on the length and span of the sequence, so they are worked
+    out first and the repeated sequence is built in one go.
+
+    Returns the tiled (times, levels)
+    """
+    times = np.asarray(times, dtype=float)
+    levels = np.asarray(levels)
+    shifts = []
+    first = times[0]
+    last = times[-1]
+    length = len(times)
+    while last < tstop:
+        span = last - first
+        shift = int(span + span / (length - 1))
+        shifts.append(shift)
+        last = last + shift
+        length *= 2
+
+    n_copies = 2 ** len(shifts)
+    copies = np.arange(n_copies)
+    tiled_times = np.tile(times, (n_copies, 1))
+    # Copy j is shifted by the shifts of the bits set in j, added in the
+    # same order as when the copies are appended one after the other
+    for bit, shift in enumerate(shifts):
+        tiled_times += (((copies >> bit) & 1) * shift)[:, None]
+    return tiled_times.ravel(), np.tile(levels, n_copies)
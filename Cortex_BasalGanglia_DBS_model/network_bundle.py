@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Binary bundle of the saved network structure.
+
+             The network loaded by model.load_network is saved as text files
+             in network_structure/ (twelve connection lists, the cortical and
+             STN positions, the GPe stimulation order) and a pickled array of
+             striatal spike trains. Parsing these is slow for large networks
+             and is repeated on every rank.
+
+             A bundle is a directory of .npy files with a manifest.json that
+             records the bundle version and the shape, dtype and sha256
+             checksum of every array. Connections are stored sorted by their
+             postsynaptic cell, with an offsets array per projection, so each
+             rank only reads the connections onto its own cells from the
+             memory-mapped arrays. Spike trains are stored the same way, as
+             one array of spike times with per-neuron offsets.
+
+             Convert the text files with:
+
+                 python network_bundle.py network_structure network_structure/bundle
+"""
+
+import argparse
+import hashlib
+import json
+from pathlib import Path
+
+import numpy as np
+
+BUNDLE_VERSION = 1
+
+# Name of each projection in the bundle and its connection file
+PROJECTION_FILES = {
+    "CorticalAxonInterneuron": "CorticalAxonInterneuron_Connections.txt",
+    "InterneuronCortical": "InterneuronCortical_Connections.txt",
+    "CorticalSTN": "CorticalSTN_Connections.txt",
+    "STNGPe": "STNGPe_Connections.txt",
+    "GPeGPe": "GPeGPe_Connections.txt",
+    "GPeSTN": "GPeSTN_Connections.txt",
+    "StriatalGPe": "StriatalGPe_Connections.txt",
+    "STNGPi": "STNGPi_Connections.txt",
+    "GPeGPi": "GPeGPi_Connections.txt",
+    "GPiThalamic": "GPiThalamic_Connections.txt",
+    "ThalamicCorticalSoma": "ThalamicCorticalSoma_Connections.txt",
+    "CorticalSomaThalamic": "CorticalSomaThalamic_Connections.txt",
+}
+
+# Name of each position array in the bundle and its file
+POSITION_FILES = {
+    "cortical_xy_pos": "cortical_xy_pos.txt",
+    "STN_xy_pos": "STN_xy_pos.txt",
+}
+
+
+def _sha256(path, block_size=2**20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _csr_index(offsets, rows):
+    """Indices of the entries of `rows` in a CSR layout given by `offsets`"""
+    rows = np.asarray(rows, dtype=np.int64)
+    starts = np.asarray(offsets[rows], dtype=np.int64)
+    counts = np.asarray(offsets[rows + 1], dtype=np.int64) - starts
+    total = int(counts.sum())
+    if total == 0:
+        return np.zeros(0, dtype=np.int64)
+    # Each entry is the start of its row plus its position within the row
+    row_positions = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(starts, counts) + row_positions
+
+
+def connections_to_csr(connections, n_post):
+    """Sort an (n x 4) array of (pre, post, weight, delay) rows by post and
+    return the columns and the offsets of each postsynaptic cell"""
+    connections = np.asarray(connections, dtype=np.float64).reshape(-1, 4)
+    post = connections[:, 1].astype(np.int64)
+    if len(post) and (post.min() < 0 or post.max() >= n_post):
+        raise ValueError("Postsynaptic index out of range")
+    order = np.argsort(post, kind="stable")
+    offsets = np.zeros(n_post + 1, dtype=np.int64)
+    np.cumsum(np.bincount(post, minlength=n_post), out=offsets[1:])
+    return {
+        "pre": connections[order, 0].astype(np.int64),
+        "post": post[order],
+        "weight": connections[order, 2],
+        "delay": connections[order, 3],
+        "offsets": offsets,
+    }
+
+
+def spike_trains_to_csr(spike_trains):
+    """Return the offsets and concatenated spike times of a list of spike
+    trains"""
+    spike_trains = [np.asarray(times, dtype=np.float64) for times in spike_trains]
+    offsets = np.zeros(len(spike_trains) + 1, dtype=np.int64)
+    np.cumsum([len(times) for times in spike_trains], out=offsets[1:])
+    if spike_trains:
+        times = np.concatenate(spike_trains)
+    else:
+        times = np.zeros(0)
+    return offsets, times
+
+
+def write_bundle(bundle_dir, pop_size, arrays, projections):
+    """Write arrays to a bundle directory with its manifest
+
+    Inputs:
+        bundle_dir      - directory of the bundle
+
+        pop_size        - size of the populations in the network
+
+        arrays          - dictionary of array name to array
+
+        projections     - names of the projections in the bundle
+    """
+    bundle_dir = Path(bundle_dir)
+    bundle_dir.mkdir(parents=True, exist_ok=True)
+    manifest = {
+        "version": BUNDLE_VERSION,
+        "pop_size": int(pop_size),
+        "projections": list(projections),
+        "arrays": {},
+    }
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        path = bundle_dir / f"{name}.npy"
+        np.save(path, array)
+        manifest["arrays"][name] = {
+            "file": path.name,
+            "dtype": array.dtype.str,
+            "shape": list(array.shape),
+            "sha256": _sha256(path),
+        }
+    with open(bundle_dir / "manifest.json", "w") as f:
+        json.dump(manifest, f, indent=1)
+    return manifest
+
+
+def convert_network_structure(structure_dir, bundle_dir):
+    """Convert the network structure text files in structure_dir to a bundle
+
+    The striatal spike times file is a pickled array of pyNN Sequences, so
+    pyNN must be importable to convert it.
+    """
+    structure_dir = Path(structure_dir)
+    striatal_spike_times = np.load(
+        structure_dir / "Striatal_Spike_Times.npy", allow_pickle=True
+    )
+    pop_size = len(striatal_spike_times[:, 0])
+
+    arrays = {}
+    spike_offsets, spike_times = spike_trains_to_csr(
+        [sequence.value for sequence in striatal_spike_times[:, 0]]
+    )
+    arrays["striatal_spike_offsets"] = spike_offsets
+    arrays["striatal_spike_times"] = spike_times
+
+    for name, filename in POSITION_FILES.items():
+        arrays[name] = np.loadtxt(structure_dir / filename, delimiter=",")
+
+    stimulation_order = np.loadtxt(
+        structure_dir / "GPe_Stimulation_Order.txt", delimiter=","
+    )
+    arrays["GPe_stimulation_order"] = stimulation_order.astype(np.int64).ravel()
+
+    for name, filename in PROJECTION_FILES.items():
+        connections = np.loadtxt(structure_dir / filename, ndmin=2)
+        for column, values in connections_to_csr(connections, pop_size).items():
+            arrays[f"{name}_{column}"] = values
+
+    return write_bundle(bundle_dir, pop_size, arrays, PROJECTION_FILES)
+
+
+class NetworkBundle:
+    """Read access to a network structure bundle.
+
+    Arrays are memory-mapped when first used, so only the pages that are
+    read are loaded from disk.
+
+    Inputs:
+        bundle_dir      - directory of the bundle
+
+        verify          - check the sha256 checksums of all arrays
+    """
+
+    def __init__(self, bundle_dir, verify=False):
+        self.bundle_dir = Path(bundle_dir)
+        with open(self.bundle_dir / "manifest.json") as f:
+            self.manifest = json.load(f)
+        if self.manifest.get("version") != BUNDLE_VERSION:
+            raise ValueError(
+                f"Network bundle {self.bundle_dir} has version "
+                f"{self.manifest.get('version')}, expected {BUNDLE_VERSION}"
+            )
+        self.pop_size = self.manifest["pop_size"]
+        self.projections = self.manifest["projections"]
+        self._arrays = {}
+        if verify:
+            self.verify()
+
+    def verify(self):
+        """Raise an error if an array does not match its checksum"""
+        for name, entry in self.manifest["arrays"].items():
+            if _sha256(self.bundle_dir / entry["file"]) != entry["sha256"]:
+                raise ValueError(f"Checksum mismatch for {name} in {self.bundle_dir}")
+
+    def array(self, name):
+        """Memory-mapped array `name` of the bundle"""
+        if name not in self._arrays:
+            entry = self.manifest["arrays"][name]
+            array = np.load(self.bundle_dir / entry["file"], mmap_mode="r")
+            if array.dtype.str != entry["dtype"] or list(array.shape) != entry["shape"]:
+                raise ValueError(f"Array {name} in {self.bundle_dir} does not match the manifest")
+            self._arrays[name] = array
+        return self._arrays[name]
+
+    def connections(self, projection, post_indices=None):
+        """Return the connections of a projection onto the postsynaptic cells
+        `post_indices` (all cells if None) as an (n x 4) array of (pre, post,
+        weight, delay) rows, as in the connection text files"""
+        if projection not in self.projections:
+            raise KeyError(f"Unknown projection: {projection}")
+        offsets = self.array(f"{projection}_offsets")
+        if post_indices is None:
+            index = slice(None)
+            n_connections = int(offsets[-1])
+        else:
+            index = _csr_index(offsets, np.sort(post_indices))
+            n_connections = len(index)
+        connections = np.empty((n_connections, 4))
+        for ii, column in enumerate(("pre", "post", "weight", "delay")):
+            connections[:, ii] = self.array(f"{projection}_{column}")[index]
+        return connections
+
+    def spike_times(self, indices=None):
+        """Return a list of the striatal spike trains of neurons `indices`
+        (all neurons if None)"""
+        offsets = self.array("striatal_spike_offsets")
+        times = self.array("striatal_spike_times")
+        if indices is None:
+            indices = range(len(offsets) - 1)
+        return [np.array(times[offsets[i] : offsets[i + 1]]) for i in indices]
+
+    def positions(self, name):
+        """Positions array, e.g. "cortical_xy_pos" (2 x Pop_size)"""
+        return np.array(self.array(name))
+
+    def stimulation_order(self):
+        """GPe stimulation order as a list of cell indices"""
+        return [int(index) for index in self.array("GPe_stimulation_order")]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Convert the network structure text files to a bundle"
+    )
+    parser.add_argument("structure_dir", help="directory of the text files")
+    parser.add_argument("bundle_dir", help="directory to write the bundle to")
+    args = parser.parse_args()
+
+    manifest = convert_network_structure(args.structure_dir, args.bundle_dir)
+    print(
+        f"Wrote bundle version {manifest['version']} with "
+        f"{len(manifest['arrays'])} arrays to {args.bundle_dir}"
+    )
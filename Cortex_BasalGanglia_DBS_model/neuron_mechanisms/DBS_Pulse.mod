@@ -0,0 +1,47 @@
+COMMENT
+Rectangular current pulses triggered by events, for the DBS stimulation of
+GPe neurons. Each event with a positive weight turns the current on for
+pulse_width, so the stimulation needs no sampled waveform.
+ENDCOMMENT
+
+NEURON {
+	POINT_PROCESS DBSPulse
+	RANGE amp, pulse_width, i
+	ELECTRODE_CURRENT i
+}
+
+UNITS {
+	(nA) = (nanoamp)
+}
+
+PARAMETER {
+	amp = 100 (nA)
+	pulse_width = 0.06 (ms)
+}
+
+ASSIGNED {
+	i (nA)
+	on (1)
+}
+
+INITIAL {
+	i = 0
+	on = 0
+}
+
+BREAKPOINT {
+	i = on*amp
+}
+
+NET_RECEIVE (w) {
+	if (flag == 0) {
+		if (w > 0) {
+			: pulse onset, prepare to turn it off
+			on = 1
+			net_send(pulse_width, 1)
+		}
+	} else {
+		: end of the pulse
+		on = 0
+	}
+}
@@ -0,0 +1,117 @@
+COMMENT
+Gaussian membrane noise current. A new amplitude, mean + stdev * N(0, 1), is
+drawn every interval ms from del to del + dur and held until the next one,
+like the pyNN NoisyCurrentSource, but the samples are drawn on the fly from a
+Random123 stream, so no noise waveform is stored.
+
+The stream of each instance is set with setstream(id1, id2, id3), e.g. the
+gid of the cell and the random seed, so the noise of a cell does not depend
+on the number of MPI ranks. The stream restarts at every initialisation.
+ENDCOMMENT
+
+NEURON {
+	THREADSAFE
+	POINT_PROCESS MembraneNoise
+	RANGE mean, stdev, del, dur, interval, i
+	ELECTRODE_CURRENT i
+	BBCOREPOINTER donotuse
+}
+
+UNITS {
+	(nA) = (nanoamp)
+}
+
+PARAMETER {
+	mean = 0 (nA)
+	stdev = 0.005 (nA)
+	del = 0 (ms)
+	dur = 1e9 (ms)
+	interval = 1 (ms)
+}
+
+ASSIGNED {
+	i (nA)
+	amp (nA)
+	donotuse
+}
+
+VERBATIM
+#if !NRNBBCORE
+#include "nrnran123.h"
+#endif
+ENDVERBATIM
+
+INITIAL {
+	i = 0
+	amp = 0
+VERBATIM
+	if (_p_donotuse) {
+		nrnran123_setseq((nrnran123_State*)_p_donotuse, 0, 0);
+	}
+ENDVERBATIM
+	if (dur > 0) {
+		net_send(del, 1)
+	}
+}
+
+BREAKPOINT {
+	i = amp
+}
+
+FUNCTION normal() {
+VERBATIM
+	if (_p_donotuse) {
+		_lnormal = nrnran123_normal((nrnran123_State*)_p_donotuse);
+	} else {
+		/* no stream was set, the current stays at the mean */
+		_lnormal = 0.;
+	}
+ENDVERBATIM
+}
+
+PROCEDURE setstream(id1, id2, id3) {
+VERBATIM
+#if !NRNBBCORE
+	nrnran123_State** pv = (nrnran123_State**)(&_p_donotuse);
+	if (*pv) {
+		nrnran123_deletestream(*pv);
+		*pv = (nrnran123_State*)0;
+	}
+	*pv = nrnran123_newstream3((uint32_t)_lid1, (uint32_t)_lid2, (uint32_t)_lid3);
+#endif
+ENDVERBATIM
+}
+
+VERBATIM
+static void bbcore_write(double* x, int* d, int* xx, int* offset, _threadargsproto_) {
+	if (d) {
+		uint32_t* di = ((uint32_t*)d) + *offset;
+		nrnran123_State** pv = (nrnran123_State**)(&_p_donotuse);
+		char which;
+		nrnran123_getids3(*pv, di, di + 1, di + 2);
+		nrnran123_getseq(*pv, di + 3, &which);
+		di[4] = (int)which;
+	}
+	*offset += 5;
+}
+
+static void bbcore_read(double* x, int* d, int* xx, int* offset, _threadargsproto_) {
+	uint32_t* di = ((uint32_t*)d) + *offset;
+	nrnran123_State** pv = (nrnran123_State**)(&_p_donotuse);
+	*pv = nrnran123_newstream3(di[0], di[1], di[2]);
+	nrnran123_setseq(*pv, di[3], (char)di[4]);
+	*offset += 5;
+}
+ENDVERBATIM
+
+NET_RECEIVE (w) {
+	if (flag == 1) {
+		if (t < del + dur) {
+			: new noise sample, held until the next one
+			amp = mean + stdev*normal()
+			net_send(interval, 1)
+		} else {
+			amp = 0
+		}
+	}
+}
@@ -0,0 +1,354 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Direct access to the state variables recorded by PyNN populations.
+             The controller loop reads the synaptic currents at every
+             controller call; going through Population.get_data() builds a
+             full neo Block each time, so the recorded NEURON vectors are read
+             here directly instead.
+
+             A RecordingPlan lists the variables recorded from each population
+             and what they are used for, so that only the recordings which
+             are used are set up, and a RecordingSpill keeps the memory
+             held by long recordings under a budget by moving them to disk.
+"""
+
+import math
+from pathlib import Path
+
+import numpy as np
+from writers import TraceWriter, write_stitched_trace
+
+
+def _find_trace(cell, variable):
+    """Return the NEURON vector recording `variable` in a PyNN cell"""
+    for key, vector in cell._cell.traces.items():
+        if key == variable or getattr(key, "label", None) == variable:
+            return vector
+    raise KeyError(f"Variable {variable} is not recorded in cell {int(cell)}")
+
+
+class RecordingReader:
+    """Incremental reader for one recorded variable of a population.
+
+    The reader keeps a cursor into the NEURON vectors of the local cells and
+    returns only the samples recorded since the previous read, as NumPy views
+    of the vector memory. What happens to the samples that have been read is
+    set explicitly by the trim policy:
+
+        "consume"   - release() empties the vectors, so memory use is bounded
+                      by the samples recorded between two reads
+        "keep"      - the vectors are left intact (e.g. so the data can still
+                      be written out with Population.write_data at the end),
+                      only the cursor moves
+
+    Views returned by read() are only valid until release() is called or the
+    simulation is advanced.
+
+    Inputs:
+        population  - PyNN population, with `variable` already recorded
+
+        variable    - name of the recorded variable, e.g. "AMPA.i"
+
+        trim        - trim policy, "consume" or "keep"
+    """
+
+    def __init__(self, population, variable, trim="consume"):
+        if trim not in ("consume", "keep"):
+            raise ValueError(f"Unknown trim policy: {trim}")
+        self.population = population
+        self.variable = variable
+        self.trim = trim
+        self._vectors = [_find_trace(cell, variable) for cell in population]
+        self._cursor = 0
+        self._buffer = np.zeros((0, len(self._vectors)))
+
+    def __len__(self):
+        """Number of samples recorded and not yet read"""
+        return max(self._available() - self._cursor, 0)
+
+    def _available(self):
+        if not self._vectors:
+            return 0
+        return min(int(vector.size()) for vector in self._vectors)
+
+    def read(self):
+        """Return a list with one view per local cell of the samples
+        recorded since the last read"""
+        available = self._available()
+        if available < self._cursor:
+            # The vectors were cleared by someone else (e.g. a call to
+            # get_data(clear=True) on the population), start from the beginning
+            self._cursor = 0
+        start = self._cursor
+        self._cursor = available
+        return [vector.as_numpy()[start:available] for vector in self._vectors]
+
+    def read_array(self):
+        """Return the samples recorded since the last read as a (samples x
+        cells) array. The array is a reused buffer, overwritten by the next
+        call to read_array()"""
+        views = self.read()
+        n_samples = len(views[0]) if views else 0
+        if self._buffer.shape[0] < n_samples:
+            self._buffer = np.empty((n_samples, len(views)))
+        out = self._buffer[:n_samples]
+        for ii, view in enumerate(views):
+            out[:, ii] = view
+        return out
+
+    def release(self):
+        """Apply the trim policy to the samples that have been read"""
+        if self.trim == "consume":
+            for vector in self._vectors:
+                vector.resize(0)
+            self._cursor = 0
+
+    def discard(self):
+        """Drop all samples recorded since the last read"""
+        self.read()
+        self.release()
+
+
+class RecordingEntry:
+    """One recorded variable of a population in a RecordingPlan.
+
+    Inputs:
+        population          - PyNN population
+
+        variable            - name of the recorded variable, e.g.
+                              "soma(0.5).v", or "spikes"
+
+        sink                - where the samples go: "controller" (read during
+                              the simulation), "file" (written out) or
+                              "discard" (not needed, so not recorded)
+
+        sampling_interval   - time between samples (ms)
+
+        buffer_length       - length of recording held in memory at a time
+                              (ms), or None if the whole recording is held
+                              until the end of the simulation
+
+        output              - file the samples are written to at the end of
+                              the simulation, or None if the entry is
+                              written elsewhere
+    """
+
+    def __init__(
+        self,
+        population,
+        variable,
+        sink,
+        sampling_interval=None,
+        buffer_length=None,
+        output=None,
+    ):
+        if sink not in RecordingPlan.sinks:
+            raise ValueError(f"Unknown recording sink: {sink}")
+        self.population = population
+        self.variable = variable
+        self.sink = sink
+        self.sampling_interval = sampling_interval
+        self.buffer_length = buffer_length
+        self.output = output
+
+    @property
+    def recorded(self):
+        return self.sink != "discard"
+
+    def projected_bytes(self, duration):
+        """Memory held by the recording vectors of the local cells after
+        `duration` ms of recording, or None if it can not be projected
+        (spikes)"""
+        if self.variable == "spikes" or self.sampling_interval is None:
+            return None
+        if self.buffer_length is not None:
+            duration = min(duration, self.buffer_length)
+        n_samples = int(math.ceil(duration / self.sampling_interval)) + 1
+        return n_samples * self.population.local_size * 8
+
+
+class RecordingPlan:
+    """Which variables are recorded from each population, and what for.
+
+    Entries are added for every variable the model could record, and only the
+    entries whose samples go to the controller or to a file are recorded.
+    Recorded entries are recorded for the whole simulation.
+
+    Inputs:
+        duration    - length of the simulation (ms), used to project the
+                      memory use of the entries
+    """
+
+    sinks = ("controller", "file", "discard")
+
+    def __init__(self, duration):
+        self.duration = duration
+        self.entries = []
+
+    def add(
+        self,
+        population,
+        variable,
+        sink,
+        sampling_interval=None,
+        buffer_length=None,
+        output=None,
+    ):
+        """Add an entry to the plan and return it"""
+        entry = RecordingEntry(
+            population,
+            variable,
+            sink,
+            sampling_interval=sampling_interval,
+            buffer_length=buffer_length,
+            output=output,
+        )
+        self.entries.append(entry)
+        return entry
+
+    def is_recorded(self, population, variable):
+        """Whether `variable` of `population` is recorded by the plan"""
+        return any(
+            entry.recorded
+            and entry.population is population
+            and entry.variable == variable
+            for entry in self.entries
+        )
+
+    def file_outputs(self):
+        """Entries written to their output file at the end of the
+        simulation"""
+        return [
+            entry
+            for entry in self.entries
+            if entry.sink == "file" and entry.output is not None
+        ]
+
+    def instantiate(self):
+        """Set up recording for the entries that feed the controller or a
+        file"""
+        for entry in self.entries:
+            if not entry.recorded:
+                continue
+            if entry.sampling_interval is None:
+                entry.population.record(entry.variable)
+            else:
+                entry.population.record(
+                    entry.variable, sampling_interval=entry.sampling_interval
+                )
+
+    def summary(self):
+        """Table of the entries with the projected memory use of the local
+        cells"""
+        lines = ["------ Recording plan (local cells) ------"]
+        total = 0
+        for entry in self.entries:
+            projected = entry.projected_bytes(self.duration) if entry.recorded else 0
+            if projected is None:
+                memory = "n/a"
+            else:
+                memory = f"{projected / 1024**2:.2f} MB"
+                total += projected
+            interval = (
+                "-"
+                if entry.sampling_interval is None
+                else f"{entry.sampling_interval} ms"
+            )
+            lines.append(
+                f"{entry.population.label:<28} {entry.variable:<18} "
+                f"{entry.sink:<11} {interval:>8} {memory:>10}"
+            )
+        lines.append(f"Projected recording memory: {total / 1024**2:.2f} MB")
+        return "\n".join(lines)
+
+
+class RecordingSpill:
+    """Keeps the memory held by recordings under a budget by moving them to
+    disk.
+
+    The samples of each entry are read from the recording vectors and, once
+    the samples held in memory exceed the budget, appended to a chunk file
+    per entry and rank (see writers.TraceWriter) and cleared from the vectors.
+    At the end of the simulation write_outputs() stitches the chunk files of
+    all ranks into the output file of each entry.
+
+    Inputs:
+        entries         - RecordingEntry objects to spill, with an output
+
+        directory       - directory for the chunk files
+
+        budget_mb       - largest size of the samples held in memory (MB)
+
+        writer          - AsyncWriter to write the chunk files with, or None
+    """
+
+    def __init__(self, entries, directory, budget_mb, writer=None):
+        self.entries = list(entries)
+        self.directory = Path(directory)
+        self.budget_bytes = budget_mb * 1024**2
+        self.writer = writer
+        self.spills = 0
+        self.readers = []
+        self.chunk_writers = []
+        for entry in self.entries:
+            rank = entry.population._simulator.state.mpi_rank
+            self.readers.append(
+                RecordingReader(entry.population, entry.variable, trim="consume")
+            )
+            self.chunk_writers.append(
+                TraceWriter(
+                    self.directory / f"{self._stem(entry)}_rank{rank}.npy",
+                    gids=[int(cell) for cell in entry.population],
+                    sampling_interval=entry.sampling_interval,
+                    variable=entry.variable,
+                    units=_units(entry.variable),
+                    flush_calls=1,
+                    writer=writer,
+                )
+            )
+
+    @staticmethod
+    def _stem(entry):
+        return Path(entry.output).stem
+
+    def held_bytes(self):
+        """Size of the recorded samples not yet moved to disk"""
+        return sum(len(reader) * len(reader._vectors) * 8 for reader in self.readers)
+
+    def check(self):
+        """Move the recorded samples to disk if they exceed the budget"""
+        if self.held_bytes() > self.budget_bytes:
+            self.spill()
+
+    def spill(self):
+        """Move all recorded samples to disk"""
+        for reader, chunk_writer in zip(self.readers, self.chunk_writers):
+            chunk_writer.append(reader.read_array())
+            reader.release()
+        self.spills += 1
+
+    def close(self):
+        """Move the remaining samples to disk and close the chunk files"""
+        self.spill()
+        for chunk_writer in self.chunk_writers:
+            chunk_writer.close()
+
+    def write_outputs(self, writer):
+        """Write the output file of each entry from the chunk files of all
+        ranks. Called on one rank, after every rank has closed its chunk
+        files."""
+        for entry in self.entries:
+            chunk_paths = sorted(self.directory.glob(f"{self._stem(entry)}_rank*.npy"))
+            writer.submit(
+                write_stitched_trace,
+                chunk_paths,
+                entry.output,
+                name=entry.variable,
+                population_label=entry.population.label,
+                units=_units(entry.variable),
+            )
+
+
+def _units(variable):
+    """Units of a recorded state variable"""
+    return "mV" if variable.endswith(".v") else "nA"
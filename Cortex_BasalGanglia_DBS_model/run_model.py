@@ -35,19 +35,22 @@ from Controllers import (
     StandardPIDController,
     IterativeFeedbackTuningPIController,
     ConstantController,
+    pulse_train_generator,
+    check_pulse_train_generator,
 )
 import neo.io
 import quantities as pq
 import numpy as np
-import math
 import argparse
-from utils import make_beta_cheby1_filter, calculate_avg_beta_power
 from model import create_network, load_network, electrode_distance
+from connectivity import gather_build_report
+from lfp import LFPStore, LFPKernel, LFPReducer
+from biomarker import BetaBiomarker
+from dbs import DBSTimeline, DBSPlayer, GPeDBSStimulation, pulse_onset_times
+from recording import RecordingReader, RecordingPlan, RecordingSpill
+from writers import TraceWriter, AsyncWriter, write_population_data
 from config import Config, get_controller_kwargs
 
-# Import global variables for GPe DBS
-import Global_Variables as GV
-
 h = neuron.h
 comm = MPI.COMM_WORLD
 
@@ -92,10 +95,8 @@ if __name__ == "__main__":
         print("\n------ Configuration ------")
         print(c, "\n")
 
-    # Make beta band filter centred on 25Hz (cutoff frequencies are 21-29 Hz)
-    # for biomarker estimation
+    # Sampling frequency of the LFP for biomarker estimation
     fs = 1000.0 / rec_sampling_interval
-    beta_b, beta_a = make_beta_cheby1_filter(fs=fs, n=4, rp=0.5, low=21, high=29)
 
     # Use CVode to calculate i_membrane_ for fast LFP calculation
     cvode = h.CVode()
@@ -142,6 +143,10 @@ if __name__ == "__main__":
         )
         if rank == 0:
             print("Network loaded.")
+        if c.array_connectors:
+            projection_report = gather_build_report(comm)
+            if rank == 0:
+                print(projection_report, "\n")
     else:
         if rank == 0:
             print(f"Creating network ({Pop_size} cells per population)...")
@@ -177,48 +182,118 @@ if __name__ == "__main__":
         )
         if rank == 0:
             print("Network created")
+        if c.procedural_connectivity:
+            projection_report = gather_build_report(comm)
+            if rank == 0:
+                print(projection_report, "\n")
+
 
+    # Define state variables to record from each population - only the
+    # variables used by the controller or written to file are recorded
+    if save_stn_voltage:
+        STN_v_buffer_length = c.stn_voltage_flush_calls * controller_sampling_time
+    else:
+        STN_v_buffer_length = None
+    simulation_output_dir = output_dir
+    recording_plan = RecordingPlan(duration=sim_total_time)
+    for variable, filename in (
+        ("collateral(0.5).v", "Cortical_Collateral_v.mat"),
+        ("soma(0.5).v", "Cortical_Soma_v.mat"),
+    ):
+        recording_plan.add(
+            Cortical_Pop,
+            variable,
+            "file" if c.save_ctx_voltage else "discard",
+            sampling_interval=rec_sampling_interval,
+            output=simulation_output_dir / "Cortical_Pop" / filename,
+        )
+    for population, directory, prefix in (
+        (Cortical_Pop, "Cortical_Pop", "Ctx"),
+        (Interneuron_Pop, "Interneuron_Pop", "Interneuron"),
+    ):
+        for variable, name in (("GABAa.i", "GABAa_i"), ("AMPA.i", "AMPA_i")):
+            recording_plan.add(
+                population,
+                variable,
+                "file" if c.save_ctx_lfp else "discard",
+                sampling_interval=rec_sampling_interval,
+                output=simulation_output_dir / directory / f"{prefix}_{name}.mat",
+            )
+    recording_plan.add(
+        STN_Pop,
+        "soma(0.5).v",
+        "file" if save_stn_voltage else "discard",
+        sampling_interval=rec_sampling_interval,
+        buffer_length=STN_v_buffer_length,
+    )
+    for variable in ("AMPA.i", "GABAa.i"):
+        recording_plan.add(
+            STN_Pop,
+            variable,
+            "controller",
+            sampling_interval=rec_sampling_interval,
+            buffer_length=controller_sampling_time,
+        )
+    for population in (Interneuron_Pop, GPe_Pop, GPi_Pop, Thalamic_Pop):
+        recording_plan.add(
+            population,
+            "soma(0.5).v",
+            "discard",
+            sampling_interval=rec_sampling_interval,
+        )
+    recording_plan.add(Striatal_Pop, "spikes", "discard")
+    recording_plan.instantiate()
+    if rank == 0:
+        print(recording_plan.summary(), "\n")
 
-    # Define state variables to record from each population
-    if c.save_ctx_voltage:
-        Cortical_Pop.record("soma(0.5).v", sampling_interval=rec_sampling_interval)
-        Cortical_Pop.record("collateral(0.5).v", sampling_interval=rec_sampling_interval)
-    if c.save_ctx_lfp:
-        Cortical_Pop.record("AMPA.i", sampling_interval=rec_sampling_interval)
-        Cortical_Pop.record("GABAa.i", sampling_interval=rec_sampling_interval)
-        Interneuron_Pop.record("GABAa.i", sampling_interval=rec_sampling_interval)
-        Interneuron_Pop.record("AMPA.i", sampling_interval=rec_sampling_interval)
-    Interneuron_Pop.record("soma(0.5).v", sampling_interval=rec_sampling_interval)
-    STN_Pop.record("soma(0.5).v", sampling_interval=rec_sampling_interval)
-    STN_Pop.record("AMPA.i", sampling_interval=rec_sampling_interval)
-    STN_Pop.record("GABAa.i", sampling_interval=rec_sampling_interval)
-    Striatal_Pop.record("spikes")
-    GPe_Pop.record("soma(0.5).v", sampling_interval=rec_sampling_interval)
-    GPi_Pop.record("soma(0.5).v", sampling_interval=rec_sampling_interval)
-    Thalamic_Pop.record("soma(0.5).v", sampling_interval=rec_sampling_interval)
+    # Read the STN synaptic currents straight from the recording vectors at
+    # each controller call; the samples are dropped once the LFP is computed
+    STN_AMPA_reader = RecordingReader(STN_Pop, "AMPA.i", trim="consume")
+    STN_GABAa_reader = RecordingReader(STN_Pop, "GABAa.i", trim="consume")
+    if save_stn_voltage:
+        STN_v_reader = RecordingReader(STN_Pop, "soma(0.5).v", trim="consume")
 
     # Assign Positions for recording and stimulating electrode point sources
     recording_electrode_1_position = np.array([0, -1500, 250])
     recording_electrode_2_position = np.array([0, 1500, 250])
     stimulating_electrode_position = np.array([0, 0, 250])
-    #
-    # (
-    #     STN_recording_electrode_1_distances,
-    #     STN_recording_electrode_2_distances,
-    #     Cortical_Collateral_stimulating_electrode_distances,
-    # ) = electrode_distance(
-    #     recording_electrode_1_position,
-    #     recording_electrode_2_position,
-    #     STN_Pop,
-    #     stimulating_electrode_position,
-    #     Cortical_Pop,
-    # )
-    #
-    # # Conductivity and resistivity values for homogenous, isotropic medium
-    # sigma = 0.27  # Latikka et al. 2001 - Conductivity of Brain tissue S/m
-    # # rho needs units of ohm cm for xtra mechanism (S/m -> S/cm)
-    # rho = 1 / (sigma * 1e-2)
-    #
+
+    (
+        STN_recording_electrode_1_distances,
+        STN_recording_electrode_2_distances,
+        Cortical_Collateral_stimulating_electrode_distances,
+    ) = electrode_distance(
+        recording_electrode_1_position,
+        recording_electrode_2_position,
+        STN_Pop,
+        stimulating_electrode_position,
+        Cortical_Pop,
+    )
+
+    # Conductivity and resistivity values for homogenous, isotropic medium
+    sigma = 0.27  # Latikka et al. 2001 - Conductivity of Brain tissue S/m
+    # rho needs units of ohm cm for xtra mechanism (S/m -> S/cm)
+    rho = 1 / (sigma * 1e-2)
+
+    # Electrode weights for the STN LFP, calculated once. The AMPA and GABAa
+    # contributions are only computed when they are written out
+    if c.save_stn_lfp_components:
+        lfp_components = ("total", "AMPA", "GABAa")
+    else:
+        lfp_components = ("total",)
+    STN_LFP_kernel = LFPKernel(
+        STN_recording_electrode_1_distances,
+        STN_recording_electrode_2_distances,
+        sigma=sigma,
+        components=lfp_components,
+    )
+    # Only the components that are used are summed across ranks
+    # With controller_rank0_only, only rank 0 receives the summed LFP and
+    # evaluates the biomarker and controller
+    STN_LFP_reducer = LFPReducer(
+        comm, len(lfp_components), root=0 if c.controller_rank0_only else None
+    )
+
     # # Calculate transfer resistances for each collateral segment for xtra
     # # units are Mohms
     # collateral_rx = (
@@ -259,6 +334,25 @@ if __name__ == "__main__":
         if rank == 0:
             print(f"New controller window tail_length: {controller_window_tail_length_no_samples}")
 
+    # Beta band biomarker, filter centred on 25Hz (cutoff frequencies are
+    # 21-29 Hz)
+    if c.biomarker_lookback_length > 0:
+        biomarker_lookback_length = int(
+            c.biomarker_lookback_length / rec_sampling_interval
+        )
+    else:
+        biomarker_lookback_length = None
+    biomarker = BetaBiomarker(
+        fs,
+        controller_window_length_no_samples,
+        controller_window_tail_length_no_samples,
+        mode=c.biomarker_mode,
+        lookback_length=biomarker_lookback_length,
+        verify=c.biomarker_verify,
+    )
+    if rank == 0 and c.biomarker_mode == "lookback":
+        print(f"Biomarker lookback length: {biomarker.lookback_length} samples")
+
     controller_start = (
         steady_state_duration + controller_window_length + controller_sampling_time
     )
@@ -284,59 +378,71 @@ if __name__ == "__main__":
 
     controller_kwargs = get_controller_kwargs(c)
     controller = Controller(**controller_kwargs)
+    pulse_train_generator.compat = c.dbs_pulse_compat
+    if not pulse_train_generator.compat:
+        # Check that the cached pulse trains match the original DBS signal
+        if check_pulse_train_generator(n_segments=200, dt=simulator.state.dt):
+            if rank == 0:
+                print("Cached DBS pulse trains differ from the original signal, using the original")
+            pulse_train_generator.compat = True
 
-    simulation_output_dir = output_dir
     if rank == 0:
         print(f"Output directory: {simulation_output_dir}")
         simulation_output_dir.mkdir(parents=True, exist_ok=True)
 
-    # Generate a square wave which represents the DBS signal
-    # Needs to be initialized to zero when unused to prevent
-    # open-circuit of cortical collateral extracellular mechanism
-    if c.Modulation == "frequency":
-        last_pulse_time_prior = steady_state_duration
+    # Output files are written on a background thread, so the simulation does
+    # not wait for the disk
+    io_writer = AsyncWriter(max_pending=c.async_io_queue_size, threaded=c.async_io)
+
+    # STN membrane voltage is appended to one file per rank, see
+    # writers.load_trace for reading it back
+    if save_stn_voltage:
+        STN_v_writer = TraceWriter(
+            simulation_output_dir / "STN_POP" / f"STN_Soma_v_rank{rank}.npy",
+            gids=[int(cell) for cell in STN_Pop],
+            sampling_interval=rec_sampling_interval,
+            variable="soma(0.5).v",
+            units="mV",
+            flush_calls=c.stn_voltage_flush_calls,
+            flush_mb=c.stn_voltage_flush_mb,
+            writer=io_writer,
+        )
+
+    # With a recording memory budget, the recordings written to file at the
+    # end of the simulation are moved to per-rank chunk files during the
+    # simulation whenever they exceed the budget
+    if c.recording_memory_budget_mb > 0 and recording_plan.file_outputs():
+        recording_spill = RecordingSpill(
+            recording_plan.file_outputs(),
+            simulation_output_dir / "recording_chunks",
+            budget_mb=c.recording_memory_budget_mb,
+            writer=io_writer,
+        )
     else:
-        last_pulse_time_prior = 0
-    (
-        DBS_Signal,
-        DBS_times,
-        next_DBS_pulse_time,
-        last_DBS_pulse_time,
-    ) = controller.generate_dbs_signal(
+        recording_spill = None
+
+    # DBS signal time grid - samples at t = 0 and the end of the steady state,
+    # then every dt until the end of the simulation
+    DBS_timeline = DBSTimeline(
+        prefix_times=[0, steady_state_duration + 10],
         start_time=steady_state_duration + 10 + simulator.state.dt,
         stop_time=sim_total_time,
-        last_pulse_time_prior=last_pulse_time_prior,
         dt=simulator.state.dt,
-        amplitude=-1.0,
-        frequency=130.0,
-        pulse_width=0.06,
-        offset=0,
     )
 
-    DBS_Signal = np.hstack((np.array([0, 0]), DBS_Signal))
-    DBS_times = np.hstack((np.array([0, steady_state_duration + 10]), DBS_times))
-
-    # Get DBS time indexes which corresponds to controller call times
-    controller_DBS_indices = []
-    for call_time in controller_call_times:
-        indices = np.where(DBS_times == call_time)[0]
-        if len(indices) > 0:
-            controller_DBS_indices.extend([indices[0]])
-
-    # Set first portion of DBS signal (Up to first controller call after
-    # steady state) to zero amplitude
-    DBS_Signal[0:] = 0
+    # Play the DBS signal to global variable is_xtra - only the window up to
+    # the next controller call (or the DBS buffer horizon) is held at a time.
+    # The signal starts at zero amplitude up to the first controller call
+    # after steady state, to prevent open-circuit of cortical collateral
+    # extracellular mechanism
+    DBS_buffer_horizon = max(c.dbs_buffer_horizon, controller_sampling_time)
+    DBS_player = DBSPlayer(
+        DBS_timeline,
+        h._ref_is_xtra,
+        window_length=int(np.ceil(DBS_buffer_horizon / simulator.state.dt)) + 3,
+    )
     next_DBS_pulse_time = controller_call_times[0]
 
-    DBS_Signal_neuron = h.Vector(DBS_Signal)
-    DBS_times_neuron = h.Vector(DBS_times)
-
-    # Play DBS signal to global variable is_xtra
-    DBS_Signal_neuron.play(h._ref_is_xtra, DBS_times_neuron, 1)
-
-    # Get DBS_Signal_neuron as a numpy array for easy updating
-    updated_DBS_signal = DBS_Signal_neuron.as_numpy()
-
     # Initialize tracking the frequencies calculated by the controller
     last_freq_calculated = 0
     last_DBS_pulse_time = steady_state_duration
@@ -349,63 +455,24 @@ if __name__ == "__main__":
     interp_collaterals_entrained = np.array(
         [0, 0, 0, 1, 4, 8, 19, 30, 43, 59, 82, 100, 100, 100]
     )
+    # The numbers of entrained neurons are for a population of 100 neurons,
+    # scale them to the size of the GPe population
+    interp_collaterals_entrained = interp_collaterals_entrained * GPe_Pop.size / 100
 
-    if c.Modulation == "frequency":
-        last_pulse_time_prior = steady_state_duration
-    else:
-        last_pulse_time_prior = 0
-
-    # Make new GPe DBS vector for each GPe neuron - each GPe neuron needs a
-    # pointer to its own DBS signal
-    GPe_DBS_Signal_neuron = []
-    GPe_DBS_times_neuron = []
-    updated_GPe_DBS_signal = []
-    for i in range(0, Cortical_Pop.local_size):
-        (
-            GPe_DBS_Signal,
-            GPe_DBS_times,
-            GPe_next_DBS_pulse_time,
-            GPe_last_DBS_pulse_time,
-        ) = controller.generate_dbs_signal(
-            start_time=steady_state_duration + 10 + simulator.state.dt,
-            stop_time=sim_total_time,
-            last_pulse_time_prior=last_pulse_time_prior,
-            dt=simulator.state.dt,
-            amplitude=100.0,
-            frequency=130.0,
-            pulse_width=0.06,
-            offset=0,
-        )
-
-        GPe_DBS_Signal = np.hstack((np.array([0, 0]), GPe_DBS_Signal))
-        GPe_DBS_times = np.hstack(
-            (np.array([0, steady_state_duration + 10]), GPe_DBS_times)
-        )
-
-        # Set the GPe DBS signals to zero amplitude
-        GPe_DBS_Signal[0:] = 0
-        GPe_next_DBS_pulse_time = controller_call_times[0]
+    # GPe DBS stimulation - pulses are delivered as events to the entrained
+    # GPe neurons, starting with no neurons entrained
+    GPe_DBS_stimulation = GPeDBSStimulation(GPe_Pop, amplitude=100.0, pulse_width=0.06)
 
-        # Neuron vector of GPe DBS signals
-        GPe_DBS_Signal_neuron.append(h.Vector(GPe_DBS_Signal))
-        GPe_DBS_times_neuron.append(h.Vector(GPe_DBS_times))
+    # Initialise STN LFP storage - the controller window is held in a ring
+    # buffer, the full signal in preallocated chunks until it is written out
+    STN_LFP = LFPStore(controller_window_length_no_samples)
+    if c.save_stn_lfp_components:
+        STN_LFP_AMPA = LFPStore(controller_window_length_no_samples)
+        STN_LFP_GABAa = LFPStore(controller_window_length_no_samples)
 
-        # Play the stimulation into each GPe neuron
-        GPe_DBS_Signal_neuron[i].play(
-            GV.GPe_stimulation_iclamps[i]._ref_amp, GPe_DBS_times_neuron[i], 1
-        )
-
-        # Hold a reference to the signal as a numpy array, and append to list
-        # of GPe stimulation signals
-        updated_GPe_DBS_signal.append(GPe_DBS_Signal_neuron[i].as_numpy())
-
-    # Initialise STN LFP list
-    STN_LFP = []
-    STN_LFP_AMPA = []
-    STN_LFP_GABAa = []
-
-    # Variables for writing simulation data
-    last_write_time = steady_state_duration
+    # DBS update sent from rank 0 to the other ranks when only rank 0 runs the
+    # controller: (amplitude, frequency, next pulse time)
+    DBS_update = np.zeros(3)
 
     if rank == 0:
         print(
@@ -433,125 +500,76 @@ if __name__ == "__main__":
             print("Controller Called at t: %.2f" % simulator.state.t)
 
         # Calculate the LFP and biomarkers, etc.
-        STN_AMPA_i = np.array(
-            STN_Pop.get_data("AMPA.i", gather=False).segments[0].analogsignals[0]
-        )
-        STN_GABAa_i = np.array(
-            STN_Pop.get_data("GABAa.i", gather=False).segments[0].analogsignals[0]
-        )
-        STN_Syn_i = STN_AMPA_i + STN_GABAa_i
+        STN_AMPA_i = STN_AMPA_reader.read_array()
+        STN_GABAa_i = STN_GABAa_reader.read_array()
 
         # STN LFP Calculation - Syn_i is in units of nA -> LFP units are mV
-        STN_LFP_1 = (
-            (1 / (4 * math.pi * sigma))
-            * np.sum(
-                (1 / (STN_recording_electrode_1_distances * 1e-6))
-                * STN_Syn_i.transpose(),
-                axis=0,
-            )
-            * 1e-6
-        )
-        STN_LFP_2 = (
-            (1 / (4 * math.pi * sigma))
-            * np.sum(
-                (1 / (STN_recording_electrode_2_distances * 1e-6))
-                * STN_Syn_i.transpose(),
-                axis=0,
-            )
-            * 1e-6
-        )
-        STN_LFP = np.hstack(
-            (STN_LFP, comm.allreduce(STN_LFP_1 - STN_LFP_2, op=MPI.SUM))
-        )
-
-        # STN LFP AMPA and GABAa Contributions
-        STN_LFP_AMPA_1 = (
-            (1 / (4 * math.pi * sigma))
-            * np.sum(
-                (1 / (STN_recording_electrode_1_distances * 1e-6))
-                * STN_AMPA_i.transpose(),
-                axis=0,
-            )
-            * 1e-6
-        )
-        STN_LFP_AMPA_2 = (
-            (1 / (4 * math.pi * sigma))
-            * np.sum(
-                (1 / (STN_recording_electrode_2_distances * 1e-6))
-                * STN_AMPA_i.transpose(),
-                axis=0,
-            )
-            * 1e-6
-        )
-        STN_LFP_AMPA = np.hstack(
-            (STN_LFP_AMPA, comm.allreduce(STN_LFP_AMPA_1 - STN_LFP_AMPA_2, op=MPI.SUM))
+        STN_LFP_partial = STN_LFP_kernel.compute(
+            STN_AMPA_i,
+            STN_GABAa_i,
+            out=STN_LFP_reducer.buffer(STN_AMPA_i.shape[0]),
         )
+        STN_AMPA_reader.release()
+        STN_GABAa_reader.release()
+        STN_LFP_components = STN_LFP_reducer.reduce(STN_LFP_partial)
+        if STN_LFP_components is not None:
+            STN_LFP_new = STN_LFP_components[0]
+            STN_LFP.append(STN_LFP_new)
 
-        STN_LFP_GABAa_1 = (
-            (1 / (4 * math.pi * sigma))
-            * np.sum(
-                (1 / (STN_recording_electrode_1_distances * 1e-6))
-                * STN_GABAa_i.transpose(),
-                axis=0,
-            )
-            * 1e-6
-        )
-        STN_LFP_GABAa_2 = (
-            (1 / (4 * math.pi * sigma))
-            * np.sum(
-                (1 / (STN_recording_electrode_2_distances * 1e-6))
-                * STN_GABAa_i.transpose(),
-                axis=0,
-            )
-            * 1e-6
-        )
-        STN_LFP_GABAa = np.hstack(
-            (
-                STN_LFP_GABAa,
-                comm.allreduce(STN_LFP_GABAa_1 - STN_LFP_GABAa_2, op=MPI.SUM),
-            )
-        )
+            # STN LFP AMPA and GABAa Contributions
+            if c.save_stn_lfp_components:
+                STN_LFP_AMPA.append(STN_LFP_components[1])
+                STN_LFP_GABAa.append(STN_LFP_components[2])
 
-        # Biomarker Calculation:
-        lfp_beta_average_value = calculate_avg_beta_power(
-            lfp_signal=STN_LFP[-controller_window_length_no_samples:],
-            tail_length=controller_window_tail_length_no_samples,
-            beta_b=beta_b,
-            beta_a=beta_a,
-        )
+            # Biomarker Calculation:
+            lfp_beta_average_value = biomarker.update(STN_LFP_new, STN_LFP.window())
 
-        if rank == 0:
-            print("Beta Average: %f" % lfp_beta_average_value)
+            if rank == 0:
+                print("Beta Average: %f" % lfp_beta_average_value)
 
-        if c.Modulation == "frequency":
-            # Calculate the updated DBS Frequency
-            DBS_amp = 1.5
-            DBS_freq = controller.update(
-                state_value=lfp_beta_average_value, current_time=simulator.state.t
-            )
-        else:
-            # Calculate the updated DBS amplitude
-            DBS_amp = controller.update(
-                state_value=lfp_beta_average_value, current_time=simulator.state.t
-            )
-            DBS_freq = 130.0
+            if c.Modulation == "frequency":
+                # Calculate the updated DBS Frequency
+                DBS_amp = 1.5
+                DBS_freq = controller.update(
+                    state_value=lfp_beta_average_value, current_time=simulator.state.t
+                )
+            else:
+                # Calculate the updated DBS amplitude
+                DBS_amp = controller.update(
+                    state_value=lfp_beta_average_value, current_time=simulator.state.t
+                )
+                DBS_freq = 130.0
+
+            # Check if the frequency needs to change before the last time
+            # that was calculated
+            if (
+                c.Modulation == "frequency"
+                and call_index + 1 < len(controller_call_times)
+                and DBS_freq != last_freq_calculated
+            ):
+                if DBS_freq == 0.0:  # Check if DBS wants to turn off
+                    next_DBS_pulse_time = 1e9
+                else:  # Calculate new next pulse time if DBS is on
+                    T = (1.0 / DBS_freq) * 1e3
+                    next_DBS_pulse_time = last_DBS_pulse_time + T - 0.06
+
+                    # Need to check for situation when new DBS time is less than the current time
+                    if next_DBS_pulse_time <= simulator.state.t:
+                        next_DBS_pulse_time = simulator.state.t
+
+        if c.controller_rank0_only:
+            # Apply the same DBS update on every rank
+            if rank == 0:
+                DBS_update[:] = (DBS_amp, DBS_freq, next_DBS_pulse_time)
+            comm.Bcast(DBS_update, root=0)
+            DBS_amp, DBS_freq, next_DBS_pulse_time = DBS_update.tolist()
 
         # Update the DBS Signal
+        DBS_player.advance(simulator.state.t)
         if call_index + 1 < len(controller_call_times):
 
             if c.Modulation == "frequency":
                 last_pulse_time_prior = last_DBS_pulse_time
-                # Check if the frequency needs to change before the last time that was calculated
-                if DBS_freq != last_freq_calculated:
-                    if DBS_freq == 0.0:  # Check if DBS wants to turn off
-                        next_DBS_pulse_time = 1e9
-                    else:  # Calculate new next pulse time if DBS is on
-                        T = (1.0 / DBS_freq) * 1e3
-                        next_DBS_pulse_time = last_DBS_pulse_time + T - 0.06
-
-                        # Need to check for situation when new DBS time is less than the current time
-                        if next_DBS_pulse_time <= simulator.state.t:
-                            next_DBS_pulse_time = simulator.state.t
             else:
                 last_pulse_time_prior = 0
 
@@ -579,16 +597,7 @@ if __name__ == "__main__":
 
                 # Update DBS segment - replace original DBS array values with
                 # updated ones
-                indices = np.where(DBS_times == new_DBS_times_Segment[0])[0]
-                if len(indices) > 0:
-                    window_start_index = indices[0]
-                else:
-                    window_start_index = 0
-                new_window_sample_length = len(new_DBS_Signal_Segment)
-                window_end_index = window_start_index + new_window_sample_length
-                updated_DBS_signal[
-                    window_start_index:window_end_index
-                ] = new_DBS_Signal_Segment
+                DBS_player.assign(new_DBS_times_Segment[0], new_DBS_Signal_Segment)
 
                 # DBS GPe neuron stimulation
                 num_GPe_Neurons_entrained = int(
@@ -597,20 +606,14 @@ if __name__ == "__main__":
                     )
                 )
 
-                # Make copy of current DBS segment and rescale for GPe neuron
-                # stimulation
-                GPe_DBS_Segment = new_DBS_Signal_Segment.copy()
-                GPe_DBS_Segment *= -1
-                GPe_DBS_Segment[GPe_DBS_Segment > 0] = 100
-
-                # Stimulate the entrained GPe neurons
-                for i in np.arange(0, num_GPe_Neurons_entrained):
-                    cellid = Cortical_Pop[GPe_stimulation_order[i]]
-                    if Cortical_Pop.is_local(cellid):
-                        index = Cortical_Pop.id_to_local_index(cellid)
-                        updated_GPe_DBS_signal[index][
-                            window_start_index:window_end_index
-                        ] = GPe_DBS_Segment
+                # Stimulate the entrained GPe neurons with the pulses of the
+                # current DBS segment
+                GPe_DBS_stimulation.set_entrained(
+                    GPe_stimulation_order[:num_GPe_Neurons_entrained]
+                )
+                GPe_DBS_stimulation.deliver(
+                    pulse_onset_times(-new_DBS_Signal_Segment > 0, new_DBS_times_Segment)
+                )
 
                 # Remember the last frequency that was calculated
                 last_freq_calculated = DBS_freq
@@ -620,19 +623,13 @@ if __name__ == "__main__":
 
         # Write population data to file
         if save_stn_voltage:
-            write_index = "{:.0f}_".format(call_index)
-            suffix = "_{:.0f}ms-{:.0f}ms".format(
-                last_write_time, simulator.state.t)
-            fname = write_index + "STN_Soma_v" + suffix + ".mat"
-            STN_Pop.write_data(
-                str(simulation_output_dir / "STN_POP" / fname),
-                "soma(0.5).v",
-                clear=True
-            )
-        else:
-            STN_Pop.get_data("soma(0.5).v", clear=True)
+            STN_v_writer.append(STN_v_reader.read_array())
+            STN_v_reader.release()
+        if recording_spill is not None:
+            recording_spill.check()
 
-        last_write_time = simulator.state.t
+    if save_stn_voltage:
+        STN_v_writer.close()
 
     # Initialize arrays to store positions for cortical and STN populations
     Cortical_positions_array = np.zeros((Cortical_Pop.positions.shape[1], 3))
@@ -662,30 +659,42 @@ if __name__ == "__main__":
 
     # Save the cortical and STN coordinates to files
     print('Saving cortical coordinates to output directory...')
-    np.savetxt(output_dir / "cortical_xyz_cell_distribution.txt", Cortical_positions_array[:cortical_row],
-               delimiter=",")
+    io_writer.submit(
+        np.savetxt,
+        output_dir / "cortical_xyz_cell_distribution.txt",
+        Cortical_positions_array[:cortical_row],
+        delimiter=",",
+    )
     print('Saving STN coordinates to output directory...')
-    np.savetxt(output_dir / "STN_xyz_cell_distribution.txt", STN_positions_array[:stn_row], delimiter=",")
+    io_writer.submit(
+        np.savetxt,
+        output_dir / "STN_xyz_cell_distribution.txt",
+        STN_positions_array[:stn_row],
+        delimiter=",",
+    )
 
-    # Write population membrane voltage data to file
-    if c.save_ctx_voltage:
+    # Write population membrane voltage and current data to file. Recordings
+    # moved to disk under the memory budget are joined from the chunk files of
+    # all ranks once every rank has written its last chunk
+    if recording_spill is not None:
+        recording_spill.close()
+        io_writer.flush()
+        comm.Barrier()
         if rank == 0:
-            print("Saving CTX voltage...")
-        Cortical_Pop.write_data(str(simulation_output_dir / "Cortical_Pop" / "Cortical_Collateral_v.mat"), 'collateral(0.5).v', clear=False)
-        Cortical_Pop.write_data(str(simulation_output_dir / "Cortical_Pop" / "Cortical_Soma_v.mat"), 'soma(0.5).v', clear=False)
+            print(f"Joining recordings moved to disk in {recording_spill.spills} steps...")
+            recording_spill.write_outputs(io_writer)
+    else:
+        for entry in recording_plan.file_outputs():
+            if rank == 0:
+                print(f"Saving {entry.population.label} {entry.variable}...")
+            write_population_data(
+                entry.population, entry.output, entry.variable, io_writer
+            )
     # Interneuron_Pop.write_data(str(simulation_output_dir / "Interneuron_Pop/Interneuron_Soma_v.mat"), 'soma(0.5).v', clear=True)
     # GPe_Pop.write_data(str(simulation_output_dir / "GPe_Pop/GPe_Soma_v.mat", 'soma(0.5).v'), clear=True)
     # GPi_Pop.write_data(str(simulation_output_dir / "GPi_Pop/GPi_Soma_v.mat", 'soma(0.5).v'), clear=True)
     # Thalamic_Pop.write_data(str(simulation_output_dir / "Thalamic_Pop/Thalamic_Soma_v.mat"), 'soma(0.5).v', clear=True)
 
-    if c.save_ctx_lfp:
-        if rank == 0:
-            print("Saving CTX currents...")
-        Cortical_Pop.write_data(str(simulation_output_dir / "Cortical_Pop" / "Ctx_GABAa_i.mat"), "GABAa.i", clear=False)
-        Cortical_Pop.write_data(str(simulation_output_dir / "Cortical_Pop" / "Ctx_AMPA_i.mat"), "AMPA.i", clear=False)
-        Interneuron_Pop.write_data(str(simulation_output_dir / "Interneuron_Pop" / "Interneuron_GABAa_i.mat"), "GABAa.i", clear=False)
-        Interneuron_Pop.write_data(str(simulation_output_dir / "Interneuron_Pop" / "Interneuron_AMPA_i.mat"), "AMPA.i", clear=False)
-
     # Write controller values to csv files
     controller_measured_beta_values = np.asarray(controller.state_history)
     controller_measured_error_values = np.asarray(controller.error_history)
@@ -709,107 +718,166 @@ if __name__ == "__main__":
         controller_integral_term_history = None
 
     if rank == 0:
-        np.savetxt(
+        io_writer.submit(
+            np.savetxt,
             simulation_output_dir / "controller_beta_values.csv",
             controller_measured_beta_values,
             delimiter=",",
         )
-        np.savetxt(
+        io_writer.submit(
+            np.savetxt,
             simulation_output_dir / "controller_error_values.csv",
             controller_measured_error_values,
             delimiter=",",
         )
-        np.savetxt(
+        io_writer.submit(
+            np.savetxt,
             simulation_output_dir / "controller_values.csv",
             controller_output_values,
             delimiter=",",
         )
-        np.savetxt(
+        io_writer.submit(
+            np.savetxt,
             simulation_output_dir / "controller_sample_times.csv",
             controller_sample_times,
             delimiter=",",
         )
         if controller_iteration_history is not None:
-            np.savetxt(
+            io_writer.submit(
+                np.savetxt,
                 simulation_output_dir / "controller_iteration_values.csv",
                 controller_iteration_history,
                 delimiter=",",
             )
         if controller_reference_history is not None:
-            np.savetxt(
+            io_writer.submit(
+                np.savetxt,
                 simulation_output_dir / "controller_reference_values.csv",
                 controller_reference_history,
                 delimiter=",",
             )
         if controller_parameter_history is not None:
-            np.savetxt(
+            io_writer.submit(
+                np.savetxt,
                 simulation_output_dir / "controller_parameter_values.csv",
                 controller_parameter_history,
                 delimiter=",",
             )
         if controller_integral_term_history is not None:
-            np.savetxt(
+            io_writer.submit(
+                np.savetxt,
                 simulation_output_dir / "controller_integral_term_values.csv",
                 controller_integral_term_history,
                 delimiter=",",
             )
 
-    # Write the STN LFP to .mat file
-    STN_LFP_Block = neo.Block(name="STN_LFP")
-    STN_LFP_seg = neo.Segment(name="segment_0")
-    STN_LFP_Block.segments.append(STN_LFP_seg)
-    STN_LFP_signal = neo.AnalogSignal(
-        STN_LFP,
-        units="mV",
-        t_start=0 * pq.ms,
-        sampling_rate=pq.Quantity(1.0 / rec_sampling_interval, "1/ms"),
-    )
-    STN_LFP_seg.analogsignals.append(STN_LFP_signal)
-
-    w = neo.io.NeoMatlabIO(filename=str(simulation_output_dir / "STN_LFP.mat"))
-    w.write_block(STN_LFP_Block)
-
-    # # Write LFP AMPA and GABAa components to file
-    # STN_LFP_AMPA_Block = neo.Block(name='STN_LFP_AMPA')
-    # STN_LFP_AMPA_seg = neo.Segment(name='segment_0')
-    # STN_LFP_AMPA_Block.segments.append(STN_LFP_AMPA_seg)
-    # STN_LFP_AMPA_signal = neo.AnalogSignal(STN_LFP_AMPA, units='mV', t_start=0*pq.ms, sampling_rate=pq.Quantity(1.0 / rec_sampling_interval, '1/ms'))
-    # STN_LFP_AMPA_seg.analogsignals.append(STN_LFP_AMPA_signal)
-    # w = neo.io.NeoMatlabIO(filename=str(simulation_output_dir / "STN_LFP_AMPA.mat"))
-    # w.write_block(STN_LFP_AMPA_Block)
-
-    # STN_LFP_GABAa_Block = neo.Block(name='STN_LFP_GABAa')
-    # STN_LFP_GABAa_seg = neo.Segment(name='segment_0')
-    # STN_LFP_GABAa_Block.segments.append(STN_LFP_GABAa_seg)
-    # STN_LFP_GABAa_signal = neo.AnalogSignal(STN_LFP_GABAa, units='mV', t_start=0*pq.ms, sampling_rate=pq.Quantity(1.0 / rec_sampling_interval, '1/ms'))
-    # STN_LFP_GABAa_seg.analogsignals.append(STN_LFP_GABAa_signal)
-    # w = neo.io.NeoMatlabIO(filename=str(simulation_output_dir / "STN_LFP_GABAa.mat"))
-    # w.write_block(STN_LFP_GABAa_Block)
+    if c.biomarker_verify and rank == 0:
+        verification = biomarker.verification_summary()
+        print(
+            f"Biomarker ({c.biomarker_mode}) deviation from filtfilt over "
+            f"{verification['calls']} calls: "
+            f"max abs {verification['max_abs_deviation']:.6g}, "
+            f"max rel {verification['max_rel_deviation']:.6g}"
+        )
+        io_writer.submit(
+            np.savetxt,
+            simulation_output_dir / "biomarker_verification.csv",
+            np.asarray(biomarker.verification_history),
+            delimiter=",",
+            header="estimate,filtfilt",
+        )
+
+    # Only rank 0 holds the full STN LFP when controller_rank0_only is set, and
+    # the signal is the same on every rank otherwise
+    if rank == 0:
+        # Write the STN LFP to .mat file
+        STN_LFP_Block = neo.Block(name="STN_LFP")
+        STN_LFP_seg = neo.Segment(name="segment_0")
+        STN_LFP_Block.segments.append(STN_LFP_seg)
+        STN_LFP_signal = neo.AnalogSignal(
+            STN_LFP.to_array(),
+            units="mV",
+            t_start=0 * pq.ms,
+            sampling_rate=pq.Quantity(1.0 / rec_sampling_interval, "1/ms"),
+        )
+        STN_LFP_seg.analogsignals.append(STN_LFP_signal)
+
+        io_writer.submit(
+            neo.io.NeoMatlabIO(filename=str(simulation_output_dir / "STN_LFP.mat")).write_block,
+            STN_LFP_Block,
+        )
+
+        # Write LFP AMPA and GABAa components to file
+        if c.save_stn_lfp_components:
+            STN_LFP_AMPA_Block = neo.Block(name="STN_LFP_AMPA")
+            STN_LFP_AMPA_seg = neo.Segment(name="segment_0")
+            STN_LFP_AMPA_Block.segments.append(STN_LFP_AMPA_seg)
+            STN_LFP_AMPA_signal = neo.AnalogSignal(
+                STN_LFP_AMPA.to_array(),
+                units="mV",
+                t_start=0 * pq.ms,
+                sampling_rate=pq.Quantity(1.0 / rec_sampling_interval, "1/ms"),
+            )
+            STN_LFP_AMPA_seg.analogsignals.append(STN_LFP_AMPA_signal)
+            io_writer.submit(
+                neo.io.NeoMatlabIO(filename=str(simulation_output_dir / "STN_LFP_AMPA.mat")).write_block,
+                STN_LFP_AMPA_Block,
+            )
+
+            STN_LFP_GABAa_Block = neo.Block(name="STN_LFP_GABAa")
+            STN_LFP_GABAa_seg = neo.Segment(name="segment_0")
+            STN_LFP_GABAa_Block.segments.append(STN_LFP_GABAa_seg)
+            STN_LFP_GABAa_signal = neo.AnalogSignal(
+                STN_LFP_GABAa.to_array(),
+                units="mV",
+                t_start=0 * pq.ms,
+                sampling_rate=pq.Quantity(1.0 / rec_sampling_interval, "1/ms"),
+            )
+            STN_LFP_GABAa_seg.analogsignals.append(STN_LFP_GABAa_signal)
+            io_writer.submit(
+                neo.io.NeoMatlabIO(filename=str(simulation_output_dir / "STN_LFP_GABAa.mat")).write_block,
+                STN_LFP_GABAa_Block,
+            )
 
     # Write the DBS Signal to .mat file
+    DBS_Signal = DBS_player.finish()
+    DBS_times = DBS_timeline.times()
+
     # DBS Amplitude
     DBS_Block = neo.Block(name="DBS_Signal")
     DBS_Signal_seg = neo.Segment(name="segment_0")
     DBS_Block.segments.append(DBS_Signal_seg)
     DBS_signal = neo.AnalogSignal(
-        DBS_Signal_neuron,
+        DBS_Signal,
         units="mA",
         t_start=0 * pq.ms,
         sampling_rate=pq.Quantity(1.0 / simulator.state.dt, "1/ms"),
     )
     DBS_Signal_seg.analogsignals.append(DBS_signal)
     DBS_times = neo.AnalogSignal(
-        DBS_times_neuron,
+        DBS_times,
         units="ms",
-        t_start=DBS_times_neuron * pq.ms,
+        t_start=DBS_times * pq.ms,
         sampling_rate=pq.Quantity(1.0 / simulator.state.dt, "1/ms"),
     )
     DBS_Signal_seg.analogsignals.append(DBS_times)
 
-    w = neo.io.NeoMatlabIO(filename=str(simulation_output_dir / "DBS_Signal.mat"))
-    w.write_block(DBS_Block)
+    io_writer.submit(
+        neo.io.NeoMatlabIO(filename=str(simulation_output_dir / "DBS_Signal.mat")).write_block,
+        DBS_Block,
+    )
 
+    io_writer.close()
     if rank == 0:
+        io_report = io_writer.report()
+        print(
+            f"Output writes: {io_report['jobs']} jobs, "
+            f"{io_report['write_time']:.2f} s writing, "
+            f"{io_report['blocked_time']:.2f} s blocked on a full queue, "
+            f"{io_report['flush_time']:.2f} s waiting at the end, "
+            f"{100 * io_report['overlap']:.0f}% overlapped with the simulation"
+        )
+        print(simulator.state.current_source_report())
         print("Simulation Done!")
 
     end()
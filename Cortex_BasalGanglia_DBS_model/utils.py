@@ -1,5 +1,7 @@
+import zlib
 import numpy as np
 import scipy.signal as signal
+from functools import lru_cache
 from pyNN.parameters import Sequence
 
 
@@ -14,6 +16,9 @@ def generate_poisson_spike_times(
     """generate_population_spike_times generates (N = pop_size) Poisson
     distributed spiketrains with firing rate fr.
 
+    Returns a (pop_size x 1) array of Sequences, see poisson_spike_trains
+    for the spike trains in a compact layout.
+
     Example inputs:
         pop_size = 10
         start_time = 0.0		# ms
@@ -21,28 +26,189 @@ def generate_poisson_spike_times(
         timestep = 1  			# ms
         fr = 1					# Hz
     """
+    return poisson_spike_trains(
+        pop_size, start_time, duration, fr, timestep, random_seed
+    ).sequences()
+
+
+def poisson_spike_trains(pop_size, start_time, duration, fr, timestep, random_seed):
+    """Poisson spike trains with firing rate fr (Hz) on a time grid of
+    `timestep` ms, as SpikeTrains.
+
+    Each time bin of each neuron has a spike with probability fr * timestep,
+    as in generate_poisson_spike_times. Instead of drawing every bin, the
+    number of bins between spikes is drawn directly: it is geometrically
+    distributed, i.e. an exponential interval rounded down to the grid. The
+    intervals of neuron i come from its own counter-based random stream, so
+    the spike train of a neuron does not depend on pop_size, and the memory
+    used is proportional to the number of spikes.
+    """
+    n_bins = int(np.floor(duration / timestep))
+    p = fr * timestep / 1000.0
+    if p <= 0 or n_bins == 0:
+        return SpikeTrains(np.zeros(pop_size + 1, dtype=np.int64), np.zeros(0))
+
+    # Bins between spikes are 1 + floor(E / mu) for an exponential E, the
+    # first spike is in bin floor(E / mu)
+    mu = -np.log1p(-p) if p < 1 else np.inf
+
+    def bins_between_spikes(u):
+        with np.errstate(divide="ignore"):
+            return np.floor(-np.log1p(-u) / mu) + 1
+
+    offsets, bins = _cumulative_intervals(
+        pop_size,
+        n_bins,
+        bins_between_spikes,
+        n_bins * min(p, 1.0),
+        random_seed,
+        stream_id("poisson_spike_trains"),
+        start=-1,
+    )
+    return SpikeTrains(offsets, start_time + bins * timestep)
+
+
+def inhomogeneous_poisson_spike_trains(
+    pop_size,
+    step_times,
+    step_rates,
+    tstart,
+    tstop,
+    random_seed,
+    isi_dither=0.0,
+):
+    """Inhomogeneous Poisson spike trains with a piecewise-constant firing
+    rate, as SpikeTrains.
+
+    The rate is step_rates[i] (Hz) from step_times[i] (ms) up to the next
+    step, and step_rates[0] before the first step, as in burst_txt_to_signal.
+    Spike times are found by time-rescaling: unit-rate Poisson spike times
+    are drawn from exponential intervals and mapped through the inverse of
+    the integrated rate, so the cost depends on the number of spikes and the
+    number of steps, not on a time grid. Each spike is then jittered by a
+    normal random time with standard deviation isi_dither (ms), and the spike
+    times of each neuron are sorted. Neuron i has its own counter-based
+    random streams.
+    """
+    step_times = np.asarray(step_times, dtype=np.float64)
+    step_rates = np.asarray(step_rates, dtype=np.float64)
+
+    # Steps of the rate within [tstart, tstop)
+    inside = (step_times > tstart) & (step_times < tstop)
+    breaks = np.concatenate(([tstart], step_times[inside], [tstop]))
+    first = max(int(np.searchsorted(step_times, tstart, side="right")) - 1, 0)
+    rates = np.concatenate(([step_rates[first]], step_rates[inside]))
+    if np.any(rates < 0):
+        raise ValueError("Firing rates must not be negative")
+
+    # Integrated rate (expected number of spikes) at each break
+    integrated = np.concatenate(([0.0], np.cumsum(rates * np.diff(breaks) / 1000.0)))
+    total = integrated[-1]
+    if total <= 0:
+        return SpikeTrains(np.zeros(pop_size + 1, dtype=np.int64), np.zeros(0))
+
+    def unit_rate_intervals(u):
+        return -np.log1p(-u)
+
+    offsets, rescaled = _cumulative_intervals(
+        pop_size,
+        total,
+        unit_rate_intervals,
+        total,
+        random_seed,
+        stream_id("inhomogeneous_poisson_spike_trains"),
+    )
+    times = np.interp(rescaled, integrated, breaks)
+
+    if isi_dither > 0 and len(times):
+        neurons = np.repeat(np.arange(pop_size), np.diff(offsets))
+        spike_index = np.arange(len(times)) - offsets[neurons]
+        times += isi_dither * _counter_normal(
+            random_seed, stream_id("inhomogeneous_poisson_dither"), neurons, spike_index
+        )
+        times = times[np.lexsort((times, neurons))]
+    return SpikeTrains(offsets, times)
+
+
+def _cumulative_intervals(pop_size, limit, intervals, expected, random_seed, stream, start=0.0):
+    """Cumulative sums of random intervals for each of pop_size neurons,
+    up to `limit`
+
+    The intervals of neuron i are intervals(u) for uniform random numbers u
+    from its own counter-based stream. They are drawn in batches for all
+    neurons that have not reached the limit yet, starting with a batch a bit
+    larger than the expected number of intervals.
+
+    Returns the offsets and values of the sums below limit of each neuron, in
+    a CSR layout (see SpikeTrains)
+    """
+    batch = int(np.ceil(expected + 4 * np.sqrt(expected))) + 4
+    batch_neurons = []
+    batch_values = []
+    last = np.full(pop_size, start, dtype=np.float64)
+    active = np.arange(pop_size)
+    counter = 0
+    while len(active):
+        u = counter_uniform(random_seed, stream, active, np.arange(counter, counter + batch))
+        values = last[active, None] + np.cumsum(intervals(u), axis=1)
+        last[active] = values[:, -1]
+        within = values < limit
+        batch_neurons.append(np.repeat(active, batch)[within.ravel()])
+        batch_values.append(values[within])
+        active = active[last[active] < limit]
+        counter += batch
+
+    # Group the values by neuron, the batches of each neuron are in order
+    neurons = np.concatenate(batch_neurons)
+    order = np.argsort(neurons, kind="stable")
+    offsets = np.zeros(pop_size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(neurons, minlength=pop_size), out=offsets[1:])
+    return offsets, np.concatenate(batch_values)[order]
+
+
+def _counter_normal(seed, stream, indices, counters):
+    """Standard normal random numbers, one for each (indices[i],
+    counters[i]) pair, from the counter-based generator (Box-Muller with
+    counters 2k and 2k + 1)"""
+    counters = 2 * np.asarray(counters, dtype=np.uint64)
+    u1 = counter_uniform_pairs(seed, stream, indices, counters)
+    u2 = counter_uniform_pairs(seed, stream, indices, counters + np.uint64(1))
+    return np.sqrt(-2.0 * np.log1p(-u1)) * np.cos(2.0 * np.pi * u2)
+
+
+class SpikeTrains:
+    """Spike trains of a population in a compact (CSR) layout: the spike
+    times of neuron i are times[offsets[i]:offsets[i + 1]].
+
+    Inputs:
+        offsets     - start of the spike times of each neuron, with the total
+                      number of spikes appended
+
+        times       - spike times of all neurons (ms)
+    """
 
-    # Convert to sec for calculating the spikes matrix
-    dt = float(timestep) / 1000.0  # sec
-    sim_time = float(((start_time + duration) - start_time) / 1000.0)  # sec
-    n_bins = int(np.floor(sim_time / dt))
+    def __init__(self, offsets, times):
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.times = np.asarray(times, dtype=np.float64)
 
-    spike_matrix = np.where(np.random.uniform(0, 1, (pop_size, n_bins)) < fr * dt)
+    def __len__(self):
+        return len(self.offsets) - 1
 
-    # Create time vector - ms
-    t_vec = np.arange(start_time, start_time + duration, timestep)
+    def __getitem__(self, i):
+        """Spike times of neuron i"""
+        return self.times[self.offsets[i] : self.offsets[i + 1]]
 
-    # Make array of spike times
-    for neuron_index in np.arange(pop_size):
-        neuron_spike_times = t_vec[
-            spike_matrix[1][np.where(spike_matrix[0][:] == neuron_index)]
-        ]
-        if neuron_index == 0:
-            spike_times = Sequence(neuron_spike_times)
-        else:
-            spike_times = np.vstack((spike_times, Sequence(neuron_spike_times)))
+    def sequence(self, i):
+        """Spike times of neuron i as a pyNN Sequence"""
+        return Sequence(self[i])
 
-    return spike_times
+    def sequences(self):
+        """(n x 1) array of the spike trains as pyNN Sequences, e.g. for
+        SpikeSourceArray"""
+        sequences = np.empty((len(self), 1), dtype=object)
+        for i in range(len(self)):
+            sequences[i, 0] = self.sequence(i)
+        return sequences
 
 
 def burst_txt_to_signal(
@@ -53,28 +219,18 @@ def burst_txt_to_signal(
         dt: float
         ) -> tuple[np.ndarray, np.ndarray]:
     """Generates square wave from step amplitudes and times"""
-    segments = []
+    tt = np.asarray(tt)
+    aa = np.asarray(aa, dtype=float)
+    # Steps up to tstop, each lasting until the next step, or tstop
+    n_steps = np.searchsorted(tt, tstop, side="right")
+    next_t = np.append(tt[1:n_steps], tstop)
+    segment_lengths = np.floor((next_t - tt[:n_steps]) / dt).astype(int)
+    signal = np.repeat(aa[:n_steps], segment_lengths)
     if tstart < tt[0]:
-        initial_segment = aa[0] * np.ones(((tt[0] - tstart) // dt))
-        segments.append(initial_segment)
-    
-    tt_length = len(tt)
-    for i, t in enumerate(tt):
-        if t > tstop:
-            break
-        
-        a = aa[i]
-        if i == (tt_length - 1) or tt[i + 1] > tstop:
-            next_t = tstop
-        else:
-            next_t = tt[i + 1]
-        segment_length = int(np.floor((next_t - t) / dt))
-        seg = a * np.ones(segment_length)
-        segments.append(seg)
-        
-    signal = np.concatenate(segments)
+        initial_length = int((tt[0] - tstart) // dt)
+        signal = np.concatenate((np.full(initial_length, aa[0], dtype=float), signal))
     signal_times = np.linspace(tstart, tstop, len(signal))
-    
+
     return signal_times, signal
 
 
@@ -86,32 +242,38 @@ def generate_inhomogeneous_poisson_spike_times(
     random_seed: int,
     isi_dither: float,
 ):
-    def one_neuron_spike_times(
+    """Inhomogeneous Poisson spike trains for a firing rate envelope (Hz)
+    sampled at times tt (ms) every dt ms, as a list of Sequences. See
+    inhomogeneous_poisson_spike_trains for an envelope given by its steps."""
+    spike_trains = inhomogeneous_poisson_spike_trains(
+        pop_size,
         tt,
         fr_envelope,
-        dt,
+        tt[0],
+        tt[-1] + dt,
         random_seed,
-        isi_dither,
-    ):
-        neuron_spike_train = np.random.rand(len(fr_envelope)) < fr_envelope * dt / 1000
-        neuron_spike_times = tt[np.nonzero(neuron_spike_train)[0]]
-        neuron_spike_times += isi_dither * np.random.randn(len(neuron_spike_times))
-        neuron_spike_times = np.sort(neuron_spike_times)
-        return Sequence(neuron_spike_times)
-    
-    spike_times = [
-        one_neuron_spike_times(tt, fr_envelope, dt, random_seed, isi_dither)
-        for _ in range(pop_size)
-    ]
-    return spike_times
-
-
-def make_beta_cheby1_filter(fs, n, rp, low, high):
-    """Calculate bandpass filter coefficients (1st Order Chebyshev Filter)"""
+        isi_dither=isi_dither,
+    )
+    return [spike_trains.sequence(i) for i in range(pop_size)]
+
+
+@lru_cache(maxsize=None)
+def make_beta_cheby1_filter(fs, n, rp, low, high, output="ba"):
+    """Calculate bandpass filter coefficients (1st Order Chebyshev Filter)
+
+    The coefficients are designed once per set of arguments and cached, so
+    the returned arrays are shared and must not be modified. With
+    output="sos" the filter is returned as second-order sections instead of
+    (b, a).
+    """
     nyq = 0.5 * fs
     lowcut = low / nyq
     highcut = high / nyq
 
+    if output == "sos":
+        sos = signal.cheby1(n, rp, [lowcut, highcut], "band", output="sos")
+        return sos
+
     b, a = signal.cheby1(n, rp, [lowcut, highcut], "band")
 
     return b, a
@@ -136,3 +298,153 @@ def calculate_avg_beta_power(lfp_signal, tail_length, beta_b, beta_a):
     avg_beta_power = np.mean(lfp_beta_signal_rectified[-2 * tail_length : -tail_length])
 
     return avg_beta_power
+
+
+class RingBuffer:
+    """Fixed-capacity buffer holding the most recent samples of a signal.
+
+    Every sample is written twice (at p and p + capacity) so that the current
+    contents can always be returned as a single contiguous view, without
+    copying or re-ordering the buffer.
+    """
+
+    def __init__(self, capacity, dtype=np.float64):
+        if capacity < 1:
+            raise ValueError("RingBuffer capacity must be at least one sample")
+        self.capacity = int(capacity)
+        self._data = np.zeros(2 * self.capacity, dtype=dtype)
+        self._pos = 0  # index where the next sample will be written
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, samples):
+        """Add new samples, overwriting the oldest ones when full"""
+        samples = np.asarray(samples, dtype=self._data.dtype).ravel()
+        n = len(samples)
+        if n == 0:
+            return
+        cap = self.capacity
+        if n > cap:
+            samples = samples[-cap:]
+            n = cap
+        k1 = min(n, cap - self._pos)
+        self._data[self._pos : self._pos + k1] = samples[:k1]
+        self._data[self._pos + cap : self._pos + cap + k1] = samples[:k1]
+        k2 = n - k1
+        if k2 > 0:
+            self._data[:k2] = samples[k1:]
+            self._data[cap : cap + k2] = samples[k1:]
+        self._pos = (self._pos + n) % cap
+        self._count = min(self._count + n, cap)
+
+    def view(self):
+        """Return the buffered samples, oldest first, as a read-only view"""
+        end = self._pos + self.capacity
+        v = self._data[end - self._count : end]
+        v.flags.writeable = False
+        return v
+
+
+class ChunkedArray:
+    """Append-only 1D array stored in fixed-size preallocated chunks.
+
+    Appending never copies previously stored samples, so the cost of each
+    append depends only on the number of new samples. The samples are only
+    assembled into one contiguous array when to_array() is called.
+    """
+
+    def __init__(self, chunk_size=2**16, dtype=np.float64):
+        self.chunk_size = int(chunk_size)
+        self.dtype = dtype
+        self._chunks = []
+        self._fill = self.chunk_size  # samples used in the last chunk
+        self._length = 0
+
+    def __len__(self):
+        return self._length
+
+    def append(self, samples):
+        """Copy new samples to the end of the array"""
+        samples = np.asarray(samples, dtype=self.dtype).ravel()
+        start = 0
+        while start < len(samples):
+            if self._fill == self.chunk_size:
+                self._chunks.append(np.empty(self.chunk_size, dtype=self.dtype))
+                self._fill = 0
+            k = min(len(samples) - start, self.chunk_size - self._fill)
+            self._chunks[-1][self._fill : self._fill + k] = samples[start : start + k]
+            self._fill += k
+            start += k
+        self._length += len(samples)
+
+    def to_array(self):
+        """Return all stored samples as one contiguous array"""
+        if not self._chunks:
+            return np.zeros(0, dtype=self.dtype)
+        parts = self._chunks[:-1] + [self._chunks[-1][: self._fill]]
+        return np.concatenate(parts)
+
+
+_GOLDEN_GAMMA = np.uint64(0x9E3779B97F4A7C15)
+
+
+def _splitmix64(x):
+    """SplitMix64 finaliser of an array of uint64, wrapping on overflow"""
+    x = np.array(x, dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        x = x + _GOLDEN_GAMMA
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def stream_id(name):
+    """Stable id of a named random stream, e.g. a projection"""
+    return zlib.crc32(name.encode())
+
+
+def counter_uniform(seed, stream, indices, counters):
+    """Uniform random numbers in [0, 1) of a counter-based generator
+
+    The number at (indices[i], counters[j]) depends only on the seed, the
+    stream, the index and the counter, so any subset can be generated
+    independently of the others.
+
+    Inputs:
+        seed        - random seed
+
+        stream      - id of the random stream, see stream_id()
+
+        indices     - e.g. the postsynaptic cell indices
+
+        counters    - counters of the numbers drawn for each index
+
+    Returns a (len(indices) x len(counters)) array
+    """
+    counters = np.asarray(counters, dtype=np.uint64)
+    keys = _stream_keys(seed, stream, indices)
+    with np.errstate(over="ignore"):
+        x = _splitmix64(keys[:, None] + counters[None, :] * _GOLDEN_GAMMA)
+    return _to_uniform(x)
+
+
+def counter_uniform_pairs(seed, stream, indices, counters):
+    """Like counter_uniform, but one number for each (indices[i],
+    counters[i]) pair"""
+    counters = np.asarray(counters, dtype=np.uint64)
+    keys = _stream_keys(seed, stream, indices)
+    with np.errstate(over="ignore"):
+        x = _splitmix64(keys + counters * _GOLDEN_GAMMA)
+    return _to_uniform(x)
+
+
+def _stream_keys(seed, stream, indices):
+    key = _splitmix64(_splitmix64(np.uint64(seed)) ^ np.uint64(stream))
+    return _splitmix64(key ^ np.asarray(indices, dtype=np.uint64))
+
+
+def _to_uniform(x):
+    """Uniform numbers in [0, 1) from the top 53 bits of uint64s"""
+    return (x >> np.uint64(11)).astype(np.float64) * 2.0**-53
@@ -0,0 +1,391 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Streaming writers for traces recorded during the simulation.
+
+             A TraceWriter appends the samples of one recorded variable to a
+             single raw .npy file, with a JSON sidecar index of the time range
+             of every block of samples, instead of writing a new file at every
+             controller call. The .npy file can be opened with np.load (also
+             memory-mapped), and load_trace() slices it by time.
+
+             An AsyncWriter runs the file writes on a background thread, so
+             the simulation can continue while data is written to disk.
+"""
+
+import json
+import queue
+import threading
+import time
+from pathlib import Path
+
+import neo
+import numpy as np
+import quantities as pq
+from pyNN.recording import get_io
+
+
+class AsyncWriter:
+    """Runs write jobs on a background thread.
+
+    Jobs are queued with submit() and run in order. The queue is bounded:
+    when `max_pending` jobs are waiting, submit() blocks until the worker has
+    caught up, so the data held by queued jobs is limited. The data passed to
+    a job is owned by the job from then on and must not be modified by the
+    caller. An error raised by a job is raised again by the next call to
+    submit(), flush() or close().
+
+    Inputs:
+        max_pending     - largest number of queued jobs
+
+        threaded        - run the jobs on a background thread, or in submit()
+                          if False
+    """
+
+    def __init__(self, max_pending=4, threaded=True):
+        self.threaded = threaded
+        self.jobs = 0
+        self.write_time = 0.0  # time spent running jobs
+        self.blocked_time = 0.0  # time submit() waited for a free slot
+        self.flush_time = 0.0  # time flush() waited for the jobs to finish
+        self._error = None
+        self._lock = threading.Lock()
+        if self.threaded:
+            self._queue = queue.Queue(maxsize=max(int(max_pending), 1))
+            self._thread = threading.Thread(
+                target=self._worker, name="AsyncWriter", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self, function, args, kwargs):
+        start = time.perf_counter()
+        try:
+            function(*args, **kwargs)
+        except Exception as error:
+            with self._lock:
+                if self._error is None:
+                    self._error = error
+        with self._lock:
+            self.jobs += 1
+            self.write_time += time.perf_counter() - start
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                self._run(*job)
+            finally:
+                self._queue.task_done()
+
+    def _raise_error(self):
+        with self._lock:
+            error, self._error = self._error, None
+        if error is not None:
+            raise error
+
+    def submit(self, function, *args, **kwargs):
+        """Queue a call of function(*args, **kwargs)"""
+        self._raise_error()
+        if not self.threaded:
+            self._run(function, args, kwargs)
+            self._raise_error()
+            return
+        start = time.perf_counter()
+        self._queue.put((function, args, kwargs))
+        self.blocked_time += time.perf_counter() - start
+
+    def flush(self):
+        """Wait until all queued jobs have run"""
+        if self.threaded:
+            start = time.perf_counter()
+            self._queue.join()
+            self.flush_time += time.perf_counter() - start
+        self._raise_error()
+
+    def close(self):
+        """Run the remaining jobs and stop the worker thread"""
+        self.flush()
+        if self.threaded and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+    def report(self):
+        """Summary of the writes and how much of them overlapped with the
+        simulation"""
+        waited = self.blocked_time + self.flush_time
+        if self.threaded and self.write_time > 0:
+            overlap = max(1.0 - waited / self.write_time, 0.0)
+        else:
+            overlap = 0.0
+        return {
+            "jobs": self.jobs,
+            "write_time": self.write_time,
+            "blocked_time": self.blocked_time,
+            "flush_time": self.flush_time,
+            "overlap": overlap,
+        }
+
+
+def write_population_data(population, path, variable, writer, clear=False):
+    """Write recorded data of a population like Population.write_data, but
+    with the file written by an AsyncWriter. Gathering the data from all
+    ranks is collective and happens in the calling thread."""
+    block = population.get_data(variable, gather=True, clear=clear)
+    if population._simulator.state.mpi_rank == 0:
+        writer.submit(get_io(str(path)).write, block)
+
+
+class TraceWriter:
+    """Append-only writer for a (samples x cells) trace.
+
+    Appended samples are buffered in memory and written to the file in one
+    sequential write when `flush_calls` blocks or `flush_mb` megabytes are
+    pending. The .npy header has a fixed size and is rewritten with the
+    current number of rows, together with the sidecar index, at every flush,
+    so the file stays readable if the simulation is interrupted.
+
+    Inputs:
+        path                - path of the .npy file, the index is written to
+                              the same path with a .json suffix
+
+        gids                - ids of the cells, one per column
+
+        sampling_interval   - time between samples (ms)
+
+        variable            - name of the recorded variable
+
+        units               - units of the samples
+
+        t_start             - time of the first sample (ms)
+
+        flush_calls         - number of appended blocks buffered before a
+                              write
+
+        flush_mb            - size of the buffered samples (MB) which
+                              triggers a write
+
+        writer              - AsyncWriter to write the file with, or None to
+                              write it directly
+    """
+
+    header_size = 256
+
+    def __init__(
+        self,
+        path,
+        gids,
+        sampling_interval,
+        variable="",
+        units="mV",
+        t_start=0.0,
+        flush_calls=10,
+        flush_mb=64.0,
+        writer=None,
+    ):
+        self.path = Path(path)
+        self.index_path = self.path.with_suffix(".json")
+        self.gids = [int(gid) for gid in gids]
+        self.n_columns = len(self.gids)
+        self.sampling_interval = float(sampling_interval)
+        self.variable = variable
+        self.units = units
+        self.t_start = float(t_start)
+        self.flush_calls = max(int(flush_calls), 1)
+        self.flush_bytes = flush_mb * 1024**2
+        self.dtype = np.dtype(np.float64)
+        self.writer = writer
+
+        self.rows = 0  # rows handed over to be written to the file
+        self.blocks = []
+        self._pending = []
+        self._pending_rows = 0
+        self._pending_bytes = 0
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, "wb")
+        self._closed = False
+        self._write_header(0)
+
+    def __len__(self):
+        return self.rows + self._pending_rows
+
+    def _write_header(self, rows):
+        header = {
+            "descr": np.lib.format.dtype_to_descr(self.dtype),
+            "fortran_order": False,
+            "shape": (rows, self.n_columns),
+        }
+        text = repr(header).encode("latin1")
+        # magic string (6 bytes), version (2 bytes), header length (2 bytes)
+        padding = self.header_size - 10 - len(text) - 1
+        if padding < 0:
+            raise ValueError("Trace header does not fit in the reserved space")
+        self._file.seek(0)
+        self._file.write(np.lib.format.magic(1, 0))
+        self._file.write(np.uint16(self.header_size - 10).tobytes())
+        self._file.write(text + b" " * padding + b"\n")
+
+    def _write_index(self, rows, blocks):
+        index = {
+            "file": self.path.name,
+            "variable": self.variable,
+            "units": self.units,
+            "sampling_interval": self.sampling_interval,
+            "dtype": self.dtype.str,
+            "shape": [rows, self.n_columns],
+            "gids": self.gids,
+            "blocks": blocks,
+        }
+        with open(self.index_path, "w") as f:
+            json.dump(index, f, indent=1)
+
+    def append(self, samples):
+        """Add a block of samples recorded since the last call"""
+        samples = np.array(samples, dtype=self.dtype, ndmin=2)
+        if samples.shape[1] != self.n_columns:
+            raise ValueError(
+                f"Expected {self.n_columns} columns, got {samples.shape[1]}"
+            )
+        if len(samples) == 0:
+            return
+        row_start = len(self)
+        row_stop = row_start + len(samples)
+        self.blocks.append(
+            {
+                "t_start": self.t_start + row_start * self.sampling_interval,
+                "t_stop": self.t_start + row_stop * self.sampling_interval,
+                "row_start": row_start,
+                "row_stop": row_stop,
+            }
+        )
+        self._pending.append(samples)
+        self._pending_rows += len(samples)
+        self._pending_bytes += samples.nbytes
+        if (
+            len(self._pending) >= self.flush_calls
+            or self._pending_bytes >= self.flush_bytes
+        ):
+            self.flush()
+
+    def _write(self, pending, row_start, rows, blocks):
+        self._file.seek(
+            self.header_size + row_start * self.n_columns * self.dtype.itemsize
+        )
+        for samples in pending:
+            self._file.write(samples.data)
+        self._write_header(rows)
+        self._file.flush()
+        self._write_index(rows, blocks)
+
+    def _submit(self, function, *args):
+        if self.writer is None:
+            function(*args)
+        else:
+            self.writer.submit(function, *args)
+
+    def flush(self):
+        """Write the buffered samples to the file"""
+        # The buffered blocks are handed over to the write, new samples are
+        # buffered in a new list
+        pending, self._pending = self._pending, []
+        row_start = self.rows
+        self.rows += self._pending_rows
+        self._pending_rows = 0
+        self._pending_bytes = 0
+        self._submit(self._write, pending, row_start, self.rows, list(self.blocks))
+
+    def close(self):
+        """Write the remaining samples and close the file"""
+        if self._closed:
+            return
+        self.flush()
+        self._submit(self._file.close)
+        self._closed = True
+
+
+def load_trace(path, t_start=None, t_stop=None):
+    """Load a trace written by TraceWriter, optionally only the samples in
+    the time range [t_start, t_stop)
+
+    Inputs:
+        path            - path of the .npy file or its .json index
+
+        t_start,
+        t_stop          - time range to load (ms), the whole trace if None
+
+    Returns the sample times (ms), the samples (memory-mapped, samples x
+    cells) and the cell ids of the columns
+    """
+    path = Path(path)
+    with open(path.with_suffix(".json")) as f:
+        index = json.load(f)
+    data = np.load(path.with_suffix(".npy"), mmap_mode="r")
+
+    dt = index["sampling_interval"]
+    t0 = index["blocks"][0]["t_start"] if index["blocks"] else 0.0
+    n_rows = data.shape[0]
+    row_start = 0
+    row_stop = n_rows
+    if t_start is not None:
+        row_start = int(np.clip(np.ceil((t_start - t0) / dt - 1e-9), 0, n_rows))
+    if t_stop is not None:
+        row_stop = int(np.clip(np.ceil((t_stop - t0) / dt - 1e-9), row_start, n_rows))
+
+    times = t0 + np.arange(row_start, row_stop) * dt
+    return times, data[row_start:row_stop], index["gids"]
+
+
+def write_stitched_trace(chunk_paths, output, name, population_label, units):
+    """Join the trace files written by each rank for one variable into a
+    single neo file, in the same layout as Population.write_data, and remove
+    the trace files
+
+    Inputs:
+        chunk_paths         - .npy files written by TraceWriter
+
+        output              - path of the output file
+
+        name                - name of the signal, i.e. the recorded variable
+
+        population_label    - label of the recorded population
+
+        units               - units of the samples
+    """
+    columns = []
+    gids = []
+    sampling_interval = None
+    for path in chunk_paths:
+        _, data, path_gids = load_trace(path)
+        if not path_gids:
+            continue
+        columns.append(data)
+        gids.extend(path_gids)
+        with open(Path(path).with_suffix(".json")) as f:
+            sampling_interval = json.load(f)["sampling_interval"]
+    if not columns:
+        return
+
+    order = np.argsort(gids)
+    samples = np.hstack(columns)[:, order]
+    gids = np.asarray(gids)[order]
+
+    block = neo.Block(name=population_label)
+    segment = neo.Segment(name="segment_0")
+    block.segments.append(segment)
+    signal = neo.AnalogSignal(
+        samples,
+        units=units,
+        t_start=0 * pq.ms,
+        sampling_period=sampling_interval * pq.ms,
+        name=name,
+        source_population=population_label,
+        array_annotations={"channel_index": np.arange(len(gids)), "source_ids": gids},
+    )
+    segment.analogsignals.append(signal)
+    get_io(str(output)).write(block)
+    del samples, columns, signal
+
+    for path in chunk_paths:
+        Path(path).unlink()
+        Path(path).with_suffix(".json").unlink()